@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (C) 2013  Remy van Elst
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, sys, json, time, shutil, argparse, tempfile, subprocess, xmlrpclib, py_compile
+
+CONFLUENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "confluence.py")
+MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "confluencecli.py")
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakeconfluence.py")
+BUDGETS = {"help": 0.1, "getpagecontent": 0.1, "agent": 0.1}
+
+def Workloads(args, workdir, content_file):
+    return (
+     ("help", lambda n: ["--help"]),
+     ("addpage", lambda n: ["addpage", "-n", "Benchmark page %d" % n, "-s", "SP0", "-f", content_file]),
+     ("updatepage", lambda n: ["updatepage", "-n", "Page 0 of SP0", "-s", "SP0", "-f", content_file]),
+     ("getpagecontent", lambda n: ["getpagecontent", "-n", "Page 1 of SP0", "-s", "SP0"]),
+     ("agent", lambda n: ["--agent-socket", os.path.join(workdir, "agent.sock"),
+      "getpagecontent", "-n", "Page %d of SP0" % n, "-s", "SP0"]),
+     ("listspace", lambda n: ["listpages", "-s", "SP0"]),
+     ("listpages", lambda n: ["listpages", "--jobs", str(args.jobs)]),
+     ("listusers", lambda n: ["listusers"]),
+     ("getallpages", lambda n: ["getallpages", "--jobs", str(args.jobs)]),
+     ("users", lambda n: ["batch", "--jobs", str(args.jobs), "-f", UserScript(workdir, n, args.users)]),
+    )
+
+def Fake(args):
+    process = subprocess.Popen([sys.executable, FAKE, "--port", "0",
+     "--spaces", str(args.spaces), "--pages", str(args.pages), "--users", str(args.users),
+     "--page-size", str(args.page_size), "--latency", str(args.latency),
+     "--jitter", str(args.jitter), "--fail-rate", str(args.fail_rate)], stdout=subprocess.PIPE)
+    url = process.stdout.readline().split()[-1]
+    return process, url, xmlrpclib.Server(url + "/rpc/xmlrpc")
+
+def Agent(url, workdir):
+    socket_path = os.path.join(workdir, "agent.sock")
+    process = subprocess.Popen([sys.executable, CONFLUENCE, "-w", url, "-u", "bench", "-p", "bench",
+     "--agent-socket", socket_path, "serve"])
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError("serve exited with status %d" % process.returncode)
+        time.sleep(0.05)
+    return process
+
+def Run(url, argv, cwd):
+    command = [sys.executable, CONFLUENCE, "-w", url, "-u", "bench", "-p", "bench"] + argv
+    if "--agent-socket" not in argv:
+        command.insert(-len(argv), "--no-agent")
+    started = time.time()
+    with open(os.devnull, "w") as devnull:
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, cwd=cwd, stdout=devnull, stderr=errors)
+            pid, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.time() - started
+            if status:
+                errors.seek(0)
+                raise RuntimeError("%s exited with status %d:\n%s" % (" ".join(argv), status, errors.read()))
+    if sys.platform == "darwin":
+        return elapsed, usage.ru_maxrss / 1024.0 / 1024.0
+    return elapsed, usage.ru_maxrss / 1024.0
+
+def UserScript(workdir, run, users):
+    filename = os.path.join(workdir, "users%d.jsonl" % run)
+    with open(filename, "w") as script:
+        for n in range(users):
+            script.write(json.dumps({"action": "adduser", "newusername": "bench%d_%d" % (run, n),
+             "fullname": "Bench user %d" % n, "email": "bench%d_%d@example.org" % (run, n),
+             "userpassword": "secret"}) + "\n")
+            script.write(json.dumps({"action": "addusertogroup", "newusername": "user%d" % n,
+             "groupname": "group0"}) + "\n")
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark confluence.py against a fake Confluence")
+    parser.add_argument("--spaces", help="Number of spaces", type=int, default=10)
+    parser.add_argument("--pages", help="Pages per space", type=int, default=100)
+    parser.add_argument("--users", help="Number of users", type=int, default=200)
+    parser.add_argument("--page-size", help="Page body size in bytes", type=int, default=2000)
+    parser.add_argument("--latency", help="Per-call latency in seconds", type=float, default=0.005)
+    parser.add_argument("--jitter", help="Per-call latency jitter in seconds", type=float, default=0.002)
+    parser.add_argument("--fail-rate", help="Fraction of calls answered with 503", type=float, default=0.0)
+    parser.add_argument("-j", "--jobs", help="--jobs passed to concurrent commands", type=int, default=8)
+    parser.add_argument("-r", "--repeat", help="Runs per workload", type=int, default=3)
+    parser.add_argument("-W", "--workload", help="Only run this workload (repeatable)", action="append")
+    parser.add_argument("--json", help="Write the results as JSON to this file")
+    parser.add_argument("--budget", help="Exit with an error when a startup workload (%s) is slower than its budget" % (
+     ", ".join(sorted(BUDGETS))), action="store_true")
+    args = parser.parse_args()
+
+    # Time the commands with cached bytecode, as an installed copy runs,
+    # even when PYTHONDONTWRITEBYTECODE is set.
+    py_compile.compile(MODULE, doraise=True)
+    fake, url, server = Fake(args)
+    workdir = tempfile.mkdtemp(prefix="confluence-bench-")
+    results = []
+    agent = None
+    try:
+        content_file = os.path.join(workdir, "content.html")
+        with open(content_file, "w") as content:
+            content.write("<p>%s</p>" % ("benchmark " * (args.page_size // 10)))
+        print("%-16s %10s %10s %8s %12s" % ("workload", "median s", "best s", "rpcs", "peak rss MB"))
+        for name, command in Workloads(args, workdir, content_file):
+            if args.workload and name not in args.workload:
+                continue
+            if name == "agent":
+                agent = Agent(url, workdir)
+            timings = []
+            peak = 0.0
+            for n in range(args.repeat):
+                exportdir = tempfile.mkdtemp(dir=workdir)
+                server.bench.reset()
+                elapsed, rss = Run(url, command(n), exportdir)
+                shutil.rmtree(exportdir)
+                timings.append(elapsed)
+                peak = max(peak, rss)
+                counts = dict((method, count) for method, count in server.bench.counts().items()
+                 if not method.startswith("bench."))
+            timings.sort()
+            result = {"workload": name, "median": timings[len(timings) // 2], "best": timings[0],
+             "rpcs": sum(counts.values()), "calls": counts, "peak_rss_mb": peak}
+            results.append(result)
+            print("%-16s %10.3f %10.3f %8d %12.1f" % (
+             name, result["median"], result["best"], result["rpcs"], result["peak_rss_mb"]))
+    finally:
+        if agent is not None:
+            agent.terminate()
+            agent.wait()
+        fake.terminate()
+        shutil.rmtree(workdir)
+    over = [result for result in results if result["median"] > BUDGETS.get(result["workload"], float("inf"))]
+    for result in over:
+        print("%s took %.3fs, over its budget of %.3fs" % (result["workload"], result["median"], BUDGETS[result["workload"]]))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"settings": vars(args), "results": results}, json_file, indent=1, sort_keys=True)
+    if args.budget and over:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
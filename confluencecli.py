@@ -0,0 +1,2171 @@
+# Copyright (C) 2013  Remy van Elst
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, xmlrpclib, argparse, string, logging, time, threading, json, StringIO, collections
+import socket, errno, random, itertools, urllib, zlib, re
+
+#
+# Logging
+#
+
+logger = logging.getLogger(__name__.rpartition('.')[0])
+
+def Logging(verbose=False):
+    logger.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+    formatter = logging.Formatter('%(levelname)s: [%(name)s] %(message)s')
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+class ConfluenceConnectionPool(object):
+    def __init__(self,size=16):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self,key):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+
+    def put(self,key,connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.size:
+                connections.append(connection)
+                return
+        connection.close()
+
+connection_pool = ConfluenceConnectionPool()
+
+class ConfluenceStats(object):
+    def __init__(self,samples=1024):
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def record(self,method,latency,sent,received,fault=False):
+        with self.lock:
+            entry = self.methods.setdefault(method, {"latencies": [], "count": 0, "total": 0.0, "max": 0.0,
+             "faults": 0, "sent": 0, "received": 0})
+            entry["count"] += 1
+            entry["total"] += latency
+            entry["max"] = max(entry["max"], latency)
+            if len(entry["latencies"]) < self.samples:
+                entry["latencies"].append(latency)
+            else:
+                slot = random.randrange(entry["count"])
+                if slot < self.samples:
+                    entry["latencies"][slot] = latency
+            entry["faults"] += int(fault)
+            entry["sent"] += sent
+            entry["received"] += received
+
+    def percentile(self,latencies,fraction):
+        return latencies[int(round(fraction * (len(latencies) - 1)))]
+
+    def summary(self):
+        with self.lock:
+            methods = sorted((method, dict(entry, latencies=sorted(entry["latencies"])))
+                             for method, entry in self.methods.items())
+        summary = []
+        for method, entry in methods:
+            latencies = entry["latencies"]
+            summary.append({"method": method, "count": entry["count"], "faults": entry["faults"],
+             "p50": self.percentile(latencies, 0.5), "p95": self.percentile(latencies, 0.95),
+             "max": entry["max"], "total": entry["total"],
+             "sent": entry["sent"], "received": entry["received"]})
+        return summary
+
+    def report(self,stream):
+        stream.write("%-34s %7s %6s %9s %9s %9s %12s %12s\n" % (
+         "method", "count", "faults", "p50 ms", "p95 ms", "max ms", "bytes sent", "bytes recv"))
+        for entry in self.summary():
+            stream.write("%-34s %7d %6d %9.1f %9.1f %9.1f %12d %12d\n" % (
+             entry["method"], entry["count"], entry["faults"], entry["p50"] * 1000,
+             entry["p95"] * 1000, entry["max"] * 1000, entry["sent"], entry["received"]))
+
+    def prometheus(self):
+        summary = self.summary()
+        metrics = (
+         ("confluence_rpc_calls_total", "counter", "XML-RPC calls made to Confluence.", "count"),
+         ("confluence_rpc_faults_total", "counter", "XML-RPC calls that failed.", "faults"),
+         ("confluence_rpc_request_bytes_total", "counter", "Request bytes sent on the wire.", "sent"),
+         ("confluence_rpc_response_bytes_total", "counter", "Response bytes received on the wire.", "received"))
+        lines = []
+        for name, metric_type, description, field in metrics:
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for entry in summary:
+                lines.append('%s{method="%s"} %d' % (name, entry["method"], entry[field]))
+        lines.append("# HELP confluence_rpc_duration_seconds XML-RPC call latency.")
+        lines.append("# TYPE confluence_rpc_duration_seconds summary")
+        for entry in summary:
+            for quantile, field in (("0.5", "p50"), ("0.95", "p95")):
+                lines.append('confluence_rpc_duration_seconds{method="%s",quantile="%s"} %f' % (
+                 entry["method"], quantile, entry[field]))
+            lines.append('confluence_rpc_duration_seconds_sum{method="%s"} %f' % (entry["method"], entry["total"]))
+            lines.append('confluence_rpc_duration_seconds_count{method="%s"} %d' % (entry["method"], entry["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self,filename,output_format="json"):
+        with open(filename + ".tmp", "w") as stats_file:
+            if output_format == "prometheus":
+                stats_file.write(self.prometheus())
+            else:
+                json.dump(self.summary(), stats_file, indent=1, sort_keys=True)
+        os.rename(filename + ".tmp", filename)
+
+stats = ConfluenceStats()
+
+class ConfluencePageSummary(collections.namedtuple("ConfluencePageSummary", "id space parentId title url")):
+    __slots__ = ()
+
+    @classmethod
+    def from_struct(cls,struct):
+        return cls(*[struct.get(field, "") for field in cls._fields])
+
+    def __getitem__(self,key):
+        if isinstance(key, basestring):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self,key):
+        return key in self._fields
+
+class ConfluenceStreamParser(object):
+    scalars = ("string", "int", "i4", "boolean", "double", "dateTime.iso8601", "base64")
+
+    def __init__(self,record=None):
+        self.record = record
+        self.records = collections.deque()
+        self.stack = []
+        self.text = []
+        self.scalar = None
+        self.key = None
+        self.current = None
+        self.structured = False
+        self.fault = None
+        from xml.parsers import expat
+        self.parser = expat.ParserCreate()
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.text.append
+
+    def feed(self,data):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse("", True)
+        if self.fault is not None:
+            raise xmlrpclib.Fault(int(self.fault.get("faultCode", 0)), self.fault.get("faultString", ""))
+
+    def start(self,tag,attrs):
+        self.stack.append(tag)
+        del self.text[:]
+        if tag == "fault":
+            self.fault = {}
+        elif tag == "struct" and len(self.stack) == 8 and self.fault is None:
+            self.current = {}
+
+    def end(self,tag):
+        text = "".join(self.text)
+        del self.text[:]
+        depth = len(self.stack)
+        self.stack.pop()
+        if tag == "name":
+            self.key = text
+        elif tag in self.scalars:
+            self.scalar = text
+        elif tag == "value":
+            value = self.scalar if self.scalar is not None else text
+            self.scalar = None
+            try:
+                value = value.encode("ascii")
+            except UnicodeError:
+                pass
+            if self.fault is not None and depth == 6:
+                self.fault[self.key] = value
+            elif self.current is not None and depth == 10:
+                self.current[self.key] = value
+            elif depth == 7 and self.fault is None:
+                if not self.structured:
+                    self.records.append(value)
+                self.structured = False
+        elif tag == "struct" and depth == 8 and self.current is not None:
+            self.records.append(self.record(self.current) if self.record else self.current)
+            self.current = None
+            self.structured = True
+
+class ConfluenceResponse(object):
+    def __init__(self,response):
+        self.response = response
+        self.received = 0
+
+    def getheader(self,name,default=None):
+        return self.response.getheader(name, default)
+
+    def read(self,amt=None):
+        data = self.response.read(amt) if amt else self.response.read()
+        self.received += len(data)
+        return data
+
+class ConfluenceTransport(xmlrpclib.Transport):
+    def __init__(self,https=False,connect_timeout=None,read_timeout=None,gzip_requests=False,pool=connection_pool):
+        xmlrpclib.Transport.__init__(self)
+        self.https = https
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool = pool
+        if gzip_requests:
+            self.encode_threshold = 1024
+        self.logger = logging.getLogger(
+            __name__ + '.'+ self.__class__.__name__
+        )
+
+    def connect(self,host):
+        import httplib
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        if self.https:
+            connection = httplib.HTTPSConnection(chost, timeout=self.connect_timeout, **(x509 or {}))
+        else:
+            connection = httplib.HTTPConnection(chost, timeout=self.connect_timeout)
+        return connection
+
+    def open_response(self,host,handler,request_body):
+        import httplib
+        connection = self.pool.get((self.https, host))
+        if connection is not None:
+            self._extra_headers = self.get_host_info(host)[1]
+            try:
+                return (connection,) + self.send_call(connection,host,handler,request_body)
+            except socket.error as err:
+                connection.close()
+                if isinstance(err, socket.timeout) or err.errno not in (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE):
+                    raise
+            except httplib.BadStatusLine:
+                connection.close()
+            self.logger.debug("Pooled connection to {} was closed, reconnecting".format(host))
+        connection = self.connect(host)
+        try:
+            return (connection,) + self.send_call(connection,host,handler,request_body)
+        except Exception:
+            connection.close()
+            raise
+
+    def send_call(self,connection,host,handler,request_body):
+        if connection.sock is None:
+            connection.connect()
+            if self.read_timeout:
+                connection.sock.settimeout(self.read_timeout)
+        self.send_request(connection, handler, request_body)
+        self.send_host(connection, host)
+        self.send_user_agent(connection)
+        sent = self.send_content(connection, request_body)
+        return sent, ConfluenceResponse(connection.getresponse(buffering=True))
+
+    def request(self,host,handler,request_body,verbose=0):
+        method = request_body[request_body.find("<methodName>") + 12:request_body.find("</methodName>")]
+        started = time.time()
+        sent = 0
+        response = None
+        failed = True
+        connection = None
+        try:
+            connection, sent, response = self.open_response(host,handler,request_body)
+            if response.response.status != 200:
+                response.read()
+                raise xmlrpclib.ProtocolError(host + handler, response.response.status,
+                                              response.response.reason, response.response.msg)
+            self.verbose = verbose
+            try:
+                result = self.parse_response(response)
+                failed = False
+                return result
+            finally:
+                self.pool.put((self.https, host), connection)
+        except xmlrpclib.Fault:
+            raise
+        except Exception:
+            if connection is not None:
+                connection.close()
+            raise
+        finally:
+            received = response.received if response else 0
+            elapsed = time.time() - started
+            stats.record(method, elapsed, sent, received, failed)
+            self.logger.debug("{}: {} bytes sent, {} bytes received, {:.1f} ms".format(
+                method, sent, received, elapsed * 1000))
+
+    def stream(self,host,handler,request_body,record=None):
+        method = request_body[request_body.find("<methodName>") + 12:request_body.find("</methodName>")]
+        started = time.time()
+        sent = 0
+        response = None
+        connection = None
+        complete = False
+        failed = True
+        try:
+            connection, sent, response = self.open_response(host,handler,request_body)
+            if response.response.status != 200:
+                response.read()
+                raise xmlrpclib.ProtocolError(host + handler, response.response.status,
+                                              response.response.reason, response.response.msg)
+            if response.getheader("Content-Encoding", "") == "gzip":
+                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                decoder = None
+            parser = ConfluenceStreamParser(record)
+            while True:
+                data = response.read(16384)
+                if not data:
+                    break
+                parser.feed(decoder.decompress(data) if decoder else data)
+                while parser.records:
+                    yield parser.records.popleft()
+            complete = True
+            parser.close()
+            while parser.records:
+                yield parser.records.popleft()
+            failed = False
+        finally:
+            if complete:
+                self.pool.put((self.https, host), connection)
+            elif connection is not None:
+                connection.close()
+            received = response.received if response else 0
+            elapsed = time.time() - started
+            stats.record(method, elapsed, sent, received, failed)
+            self.logger.debug("{}: {} bytes sent, {} bytes received, {:.1f} ms (streamed)".format(
+                method, sent, received, elapsed * 1000))
+
+    def send_content(self,connection,request_body):
+        connection.putheader("Content-Type", "text/xml")
+        if self.encode_threshold is not None and self.encode_threshold < len(request_body):
+            connection.putheader("Content-Encoding", "gzip")
+            request_body = xmlrpclib.gzip_encode(request_body)
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+        return len(request_body)
+
+class ConfluenceScheduler(object):
+    idempotent = ("login", "getSpaces", "getSpace", "getPages", "getPage", "getChildren", "getDescendents",
+     "getLabelsById", "getGroups", "getUser", "getUserGroups", "getActiveUsers")
+
+    def __init__(self,retries=4,backoff=0.5,max_backoff=30.0,concurrency=16):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.concurrency = concurrency
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.baselines = {}
+        self.decreased = 0.0
+        self.lock = threading.RLock()
+        self.tokens = {}
+        self.relogin = None
+        self.logger = logging.getLogger(
+            __name__ + '.'+ self.__class__.__name__
+        )
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self,method,latency,overloaded=False):
+        with self.condition:
+            self.in_flight -= 1
+            baseline = min(latency, self.baselines.get(method, latency) * 1.01)
+            self.baselines[method] = baseline
+            if overloaded or latency > max(4 * baseline, baseline + 0.25):
+                if time.time() - self.decreased > latency:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = time.time()
+                    self.logger.debug("Server is slow or overloaded, limiting to {} concurrent calls".format(int(self.limit)))
+            else:
+                self.limit = min(float(self.concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def transient(self,err):
+        import httplib
+        if isinstance(err, xmlrpclib.ProtocolError):
+            return err.errcode in (429, 502, 503, 504)
+        return isinstance(err, (socket.error, httplib.HTTPException))
+
+    def session_expired(self,err):
+        return "InvalidSessionException" in err.faultString or "session expired" in err.faultString
+
+    def current(self,args):
+        if args and isinstance(args[0], basestring):
+            with self.lock:
+                token = args[0]
+                while token in self.tokens:
+                    token = self.tokens[token]
+            args = (token,) + tuple(args[1:])
+        return args
+
+    def renew(self,token):
+        with self.lock:
+            if token not in self.tokens:
+                self.logger.debug("Session expired, logging in again")
+                self.tokens[token] = self.relogin()
+
+    def call(self,proxy,method,args):
+        return self.run(method,args,lambda args: getattr(proxy, method)(*args))
+
+    def stream(self,method,args,open_stream):
+        def start(args):
+            records = open_stream(args)
+            for record in records:
+                return itertools.chain((record,), records)
+            return iter(())
+        return self.run(method,args,start)
+
+    def run(self,method,args,function):
+        name = method.rpartition(".")[2]
+        attempt = 0
+        renewed = False
+        while True:
+            args = self.current(args)
+            self.acquire()
+            started = time.time()
+            try:
+                result = function(args)
+            except xmlrpclib.Fault as err:
+                self.release(method,time.time() - started)
+                if renewed or name == "login" or not self.relogin or not self.session_expired(err):
+                    raise
+                renewed = True
+                self.renew(args[0])
+                continue
+            except Exception as err:
+                transient = self.transient(err)
+                self.release(method,time.time() - started,transient)
+                if not transient or name not in self.idempotent or attempt >= self.retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                self.logger.debug("{} failed ({}), retrying in {:.1f}s".format(method, err, delay))
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.release(method,time.time() - started)
+            return result
+
+scheduler = ConfluenceScheduler()
+
+class ConfluenceMethod(object):
+    def __init__(self,server,name):
+        self.server = server
+        self.name = name
+
+    def __getattr__(self,name):
+        return ConfluenceMethod(self.server, "%s.%s" % (self.name, name))
+
+    def __call__(self,*args):
+        return self.server.scheduler.call(self.server.proxy, self.name, args)
+
+class ConfluenceServer(object):
+    def __init__(self,proxy,transport,url,scheduler=scheduler):
+        self.proxy = proxy
+        self.transport = transport
+        self.host, self.handler = urllib.splithost(urllib.splittype(url)[1])
+        self.scheduler = scheduler
+
+    def __getattr__(self,name):
+        return ConfluenceMethod(self, name)
+
+    def stream(self,record,method,*args):
+        return self.scheduler.stream(method,args,lambda args: self.transport.stream(
+            self.host,self.handler,xmlrpclib.dumps(tuple(args), method),record))
+
+class ConfluencePageCache(object):
+    def __init__(self,size=256,ttl=0):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pages = collections.OrderedDict()
+        self.titles = {}
+
+    def get(self,space_key,title):
+        with self.lock:
+            return self.lookup(self.titles.get((space_key, title)))
+
+    def get_by_id(self,page_id):
+        with self.lock:
+            return self.lookup(str(page_id))
+
+    def lookup(self,page_id):
+        if page_id not in self.pages:
+            return None
+        stored, page = self.pages.pop(page_id)
+        if self.ttl and time.time() - stored > self.ttl:
+            self.drop(page_id, page)
+            return None
+        self.pages[page_id] = (stored, page)
+        return page
+
+    def put(self,page):
+        if not self.size:
+            return
+        with self.lock:
+            page_id = str(page['id'])
+            if page_id in self.pages:
+                self.drop(page_id, self.pages.pop(page_id)[1])
+            self.pages[page_id] = (time.time(), page)
+            self.titles[(page['space'], page['title'])] = page_id
+            while len(self.pages) > self.size:
+                old_id, (stored, old_page) = self.pages.popitem(last=False)
+                self.drop(old_id, old_page)
+
+    def drop(self,page_id,page):
+        if self.titles.get((page['space'], page['title'])) == page_id:
+            del self.titles[(page['space'], page['title'])]
+
+    def invalidate(self,page_id=None,space_key=None,title=None):
+        with self.lock:
+            if title is not None:
+                page_id = self.titles.pop((space_key, title), page_id)
+            if page_id is not None:
+                if str(page_id) in self.pages:
+                    self.drop(str(page_id), self.pages.pop(str(page_id))[1])
+            elif space_key is not None:
+                for page_id, (stored, page) in self.pages.items():
+                    if page['space'] == space_key:
+                        self.drop(page_id, self.pages.pop(page_id)[1])
+
+page_cache = ConfluencePageCache()
+
+class ConfluenceSpace(object):
+    def __init__(self, token, server):
+        self.server = server
+        self.token = token
+
+    def get_all(self):
+        self.spaces = self.server.confluence2.getSpaces(self.token)
+        return self.spaces
+
+    def get_by_key(self,space_key):
+        self.space_key = space_key
+        self.space = self.server.confluence2.getSpace(self.token,self.space_key)
+        return self.space
+
+    def create(self,space_key,space_name,description=""):
+        self.space_key = space_key
+        self.space_name = space_name
+        self.space_to_create = {"key":self.space_key,"name":self.space_name}
+        if description:
+            self.space_to_create["description"] = description
+        self.server.confluence2.addSpace(self.token,self.space_to_create)
+        return self.get_by_key(space_key)
+
+    def remove(self,space_key):
+        self.space_key = space_key
+        self.server.confluence2.removeSpace(self.token,self.space_key)
+        page_cache.invalidate(space_key=self.space_key)
+
+    def get_all_pages(self,spaceKey):
+        self.spacekey = spaceKey
+        return self.server.confluence2.getPages(self.token, self.spacekey)
+
+    def iter_pages(self,spaceKey):
+        self.spacekey = spaceKey
+        return self.server.stream(ConfluencePageSummary.from_struct, "confluence2.getPages", self.token, self.spacekey)
+
+class ConfluenceGroup(object):
+    def __init__(self,token,server,groupname):
+        self.server = server
+        self.token = token
+        self.groupname = groupname
+
+    def get_all(self):
+        return self.server.confluence2.getGroups(self.token)
+
+    def add(self):
+        self.server.confluence2.addGroup(self.token,self.groupname)
+
+    def remove(self):
+        self.server.confluence2.removeGroup(self.token,self.groupname,"confluence-users")
+
+class ConfluenceUser(object):
+    def __init__(self,token,server,username):
+        self.server = server
+        self.token = token
+        self.username = username
+
+    def create(self,full_name,email,password):
+        self.password = password
+        self.email = email
+        self.full_name = full_name
+        self.user_to_create = {"name":self.username,"fullname":self.full_name,"email":self.email}
+        self.server.confluence2.addUser(self.token,self.user_to_create,self.password)
+
+    def get_info(self):
+        return self.server.confluence2.getUser(self.token,self.username)
+
+    def get_groups(self):
+        return self.server.confluence2.getUserGroups(self.token,self.username)
+
+    def remove(self):
+        self.server.confluence2.removeUser(self.token,self.username)
+
+    def deactivate(self):
+        self.server.confluence2.deactivateUser(self.token,self.username)
+
+    def reactivate(self):
+        self.server.confluence2.reactivateUser(self.token,self.username)
+
+    def add_to_group(self,group):
+        self.group = group
+        self.server.confluence2.addUserToGroup(self.token,self.username,self.group)
+
+    def remove_from_group(self,group):
+        self.group = group
+        self.server.confluence2.removeUserFromGroup(self.token,self.username,self.group)
+
+    def change_password(self,password):
+        self.password = password
+        self.server.confluence2.changeUserPassword(self.token,self.username,self.password)
+
+    def get_all(self):
+        return self.server.confluence2.getActiveUsers(self.token, True)
+
+    def iter_all(self):
+        return self.server.stream(None, "confluence2.getActiveUsers", self.token, True)
+
+class ConfluencePage(object):
+    def __init__(self,token,server,name,spaceKey,content,page_id="",label=""):
+        self.server = server
+        self.token = token
+        self.name = name
+        self.spaceKey = spaceKey
+        self.content = content
+        self.page_id = page_id
+        self.label = label
+        self.logger = logging.getLogger(
+            __name__ + '.'+ self.__class__.__name__
+        )
+        self.logger.debug('Creating a new instance (name="{}", label="{}")'.format(name, label))
+
+    def add(self,parent_id=0,content=""):
+        self.logger.debug("Add page '{}'; label = [{}]".format(self.name, self.label))
+        if content:
+            self.content = content
+        self.parent_id = parent_id
+        self.newPost = {"title":self.name,"content":self.content,"space":self.spaceKey,"parentId":str(self.parent_id)}
+        self.created_page = self.server.confluence2.storePage(self.token,self.newPost)
+        page_cache.put(self.created_page)
+        self.page_url = self.created_page["url"]
+        self.page_id = self.created_page["id"]
+        if self.label:
+            self.set_label(self.page_id)
+        return {"url": self.page_url, "id": self.page_id}
+
+    def update(self,content,parent_id=0,skip_unchanged=False,retries=3):
+        self.logger.debug("Update page '{}'; label = [{}]".format(self.name, self.label))
+        if content:
+            self.content = content
+        self.page = self.get(cached=False)
+        for attempt in range(retries + 1):
+            if skip_unchanged and self.same_content(self.page['content']):
+                self.logger.debug("Page '{}' is unchanged, not updating".format(self.name))
+                return {"url": self.page["url"], "id": self.page["id"], "changed": False}
+            self.updatedPost = {"id":self.page["id"],"title":self.name,"content":self.content,
+             "space":self.spaceKey,"version":self.page["version"],"parentId":self.page["parentId"]}
+            if str(parent_id) != "0":
+                self.updatedPost["parentId"] = str(parent_id)
+            try:
+                self.updated_page = self.server.confluence2.storePage(self.token,self.updatedPost)
+                break
+            except xmlrpclib.Fault as err:
+                if attempt == retries or "version" not in err.faultString.lower():
+                    raise
+                self.logger.debug("Version conflict on page '{}', retrying".format(self.name))
+                self.page = self.get(cached=False)
+        page_cache.put(self.updated_page)
+        self.page_url = self.updated_page["url"]
+        self.page_id = self.updated_page["id"]
+        if self.label:
+            self.set_label(self.page_id)
+        return {"url": self.page_url, "id": self.page_id, "changed": True}
+
+    def same_content(self,content):
+        new_content = self.content
+        if isinstance(new_content, str):
+            new_content = new_content.decode("utf-8", "replace")
+        return new_content == content
+
+    def get(self,cached=True):
+        self.wanted_page = None
+        if cached and self.page_id:
+            self.wanted_page = page_cache.get_by_id(self.page_id)
+        elif cached:
+            self.wanted_page = page_cache.get(self.spaceKey, self.name)
+        if self.wanted_page is None:
+            if self.page_id:
+                self.wanted_page = self.server.confluence2.getPage(self.token, self.page_id)
+            else:
+                self.wanted_page = self.server.confluence2.getPage(self.token, self.spaceKey, self.name)
+            page_cache.put(self.wanted_page)
+        return self.wanted_page
+
+    def get_content(self):
+        self.wanted_page_id = self.get_page_id
+        self.content_values = {"style": "clean"}
+        self.page_content = self.wanted_page = self.server.confluence2.renderContet(self.token, self.wanted_page_id,self.content_values)
+        return self.page_content
+
+
+    def get_id(self):
+        return self.get()['id']
+
+    def get_content(self):
+        return self.get()['content']
+
+    def remove(self):
+        self.page = self.get()
+        self.server.confluence2.removePage(self.token, self.page["id"])
+        page_cache.invalidate(self.page["id"])
+
+    def set_label(self,page_id=None):
+        self.page_id = page_id or self.get_id()
+        self.logger.debug("Set label '{}' on page {}".format(
+            self.label, self.page_id))
+        if not self.server.confluence2.addLabelByName(self.token, self.label, self.page_id):
+            self.logger.debug("Unable to set label '{}' on page ID {}".format(
+                self.label, self.page_id))
+
+    def get_content(self):
+        return self.get()['content']
+
+    def get_version(self):
+        return self.get()['version']
+
+    def get_labels(self):
+        return [label['name'] for label in self.server.confluence2.getLabelsById(self.token, self.get_id())]
+
+    def iter_descendants(self):
+        return self.server.stream(ConfluencePageSummary.from_struct, "confluence2.getDescendents", self.token, self.get_id())
+
+class ConfluenceAuth(object):
+    def __init__(self,server,username,password):
+        self.server = server
+        self.username = username
+        self.password = password
+
+    def login(self):
+        self.token = self.server.confluence2.login(self.username, self.password)
+        return self.token
+
+class ConfluenceWorkerPool(object):
+    def __init__(self,token,connect,jobs,handler):
+        self.token = token
+        self.connect = connect
+        self.handler = handler
+        assert jobs >= 1, "jobs must be at least 1"
+        import Queue
+        self.queue = Queue.Queue(maxsize=jobs * 2)
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failures = []
+        self.started = time.time()
+        self.outputs = [(stream, stream.current()) for stream in (sys.stdout, sys.stderr)
+                        if isinstance(stream, ConfluenceOutput)]
+        self.workers = []
+        for i in range(jobs):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self):
+        for stream, buffer in self.outputs:
+            if buffer is not None:
+                stream.attach(buffer)
+        server = self.connect()
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                self.handler(self.token,server,item)
+                with self.lock:
+                    self.done += 1
+            except Exception as err:
+                with self.lock:
+                    self.failures.append((item,err))
+            finally:
+                self.queue.task_done()
+
+    def submit(self,item):
+        self.queue.put(item)
+
+    def wait(self):
+        self.queue.join()
+
+    def join(self):
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        elapsed = time.time() - self.started
+        return {"done": self.done, "failed": len(self.failures), "elapsed": elapsed,
+                "rate": self.done / elapsed if elapsed else 0.0}
+
+class ConfluenceManifest(object):
+    def __init__(self,filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        try:
+            with open(self.filename) as manifest_file:
+                self.pages = json.load(manifest_file)["pages"]
+        except IOError:
+            self.pages = {}
+        self.owners = dict((entry["filename"], page_id) for page_id, entry in self.pages.items())
+        self.seen = set()
+
+    def see(self,page_id):
+        with self.lock:
+            self.seen.add(page_id)
+            return self.pages.get(page_id)
+
+    def page_filename(self,page):
+        valid_chars = "-_.() %s%s" % (string.ascii_letters, string.digits)
+        page_filename = page['space'] + "_" + page['title'] + ".html"
+        page_filename = ''.join(c for c in page_filename if c in valid_chars)
+        with self.lock:
+            entry = self.pages.get(page['id'])
+            if entry and entry['space'] == page['space'] and entry['title'] == page['title']:
+                return entry['filename']
+            if self.owners.get(page_filename, page['id']) != page['id']:
+                page_filename = "%s_%s.html" % (page_filename[:-len(".html")], page['id'])
+            self.owners[page_filename] = page['id']
+            return page_filename
+
+    def record(self,page,page_filename):
+        with self.lock:
+            entry = self.pages.get(page['id'])
+            if entry and entry['filename'] != page_filename and self.owners.get(entry['filename']) == page['id']:
+                del self.owners[entry['filename']]
+            self.pages[page['id']] = {"id": page['id'], "space": page['space'], "title": page['title'],
+             "version": str(page['version']), "modified": str(page.get('modified', "")),
+             "filename": page_filename}
+
+    def forget(self,page_id):
+        with self.lock:
+            entry = self.pages.pop(page_id)
+            if self.owners.get(entry['filename']) == page_id:
+                del self.owners[entry['filename']]
+            return entry
+
+    def stale(self):
+        with self.lock:
+            return [page_id for page_id in self.pages if page_id not in self.seen]
+
+    def save(self):
+        with open(self.filename + ".tmp", "w") as manifest_file:
+            json.dump({"pages": self.pages}, manifest_file, indent=1, sort_keys=True)
+        os.rename(self.filename + ".tmp", self.filename)
+
+class ConfluenceArchive(object):
+    suffixes = (".tar.gz", ".tgz", ".tar.bz2", ".tar", ".zip")
+
+    def __init__(self,filename,split_by_space=False):
+        self.filename = filename
+        self.split_by_space = split_by_space
+        self.lock = threading.Lock()
+        self.archives = {}
+
+    def target(self,space_key):
+        if not self.split_by_space:
+            return self.filename
+        for suffix in self.suffixes:
+            if self.filename.endswith(suffix):
+                return "%s-%s%s" % (self.filename[:-len(suffix)], space_key, suffix)
+        return "%s-%s" % (self.filename, space_key)
+
+    def open(self,filename):
+        import tarfile, zipfile
+        if filename.endswith(".zip"):
+            return zipfile.ZipFile(filename + ".tmp", "w", zipfile.ZIP_DEFLATED, True)
+        elif filename.endswith(".tar.gz") or filename.endswith(".tgz"):
+            return tarfile.open(filename + ".tmp", "w:gz")
+        elif filename.endswith(".tar.bz2"):
+            return tarfile.open(filename + ".tmp", "w:bz2")
+        return tarfile.open(filename + ".tmp", "w")
+
+    def write(self,archive,name,data):
+        import tarfile, zipfile
+        if isinstance(archive, zipfile.ZipFile):
+            archive.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data, zipfile.ZIP_DEFLATED)
+        else:
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            member.mtime = time.time()
+            archive.addfile(member, StringIO.StringIO(data))
+
+    def add(self,page,page_filename):
+        page_content = page['content']
+        if isinstance(page_content, unicode):
+            page_content = page_content.encode("utf-8")
+        filename = self.target(page['space'])
+        with self.lock:
+            if filename not in self.archives:
+                self.archives[filename] = (self.open(filename), [])
+            archive, index = self.archives[filename]
+            self.write(archive, page_filename, page_content)
+            index.append({"id": page['id'], "space": page['space'], "title": page['title'],
+             "parentId": page['parentId'], "version": str(page['version']), "url": page['url'],
+             "filename": page_filename})
+
+    def close(self):
+        for filename, (archive, index) in sorted(self.archives.items()):
+            self.write(archive, "index.json", json.dumps(index, indent=1, sort_keys=True))
+            archive.close()
+            os.rename(filename + ".tmp", filename)
+            sys.stdout.write("Wrote archive: %s\n" % filename)
+
+    def abort(self):
+        for filename, (archive, index) in self.archives.items():
+            archive.close()
+            os.remove(filename + ".tmp")
+
+class ConfluenceText(object):
+    skipped = ("script", "style")
+    handlers = ("handle_starttag", "handle_endtag", "handle_data", "handle_entityref",
+                "handle_charref", "unknown_decl")
+
+    def __init__(self):
+        import HTMLParser
+        self.parser = HTMLParser.HTMLParser()
+        for handler in self.handlers:
+            setattr(self.parser, handler, getattr(self, handler))
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self,tag,attrs):
+        if tag in self.skipped:
+            self.skipping += 1
+        self.parts.append(" ")
+
+    def handle_endtag(self,tag):
+        if tag in self.skipped and self.skipping:
+            self.skipping -= 1
+        self.parts.append(" ")
+
+    def handle_data(self,data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def handle_entityref(self,name):
+        import htmlentitydefs
+        if name in htmlentitydefs.name2codepoint:
+            self.handle_data(unichr(htmlentitydefs.name2codepoint[name]))
+
+    def handle_charref(self,name):
+        try:
+            self.handle_data(unichr(int(name[1:], 16) if name[:1] in "xX" else int(name)))
+        except ValueError:
+            pass
+
+    def unknown_decl(self,data):
+        if data.startswith("CDATA["):
+            self.handle_data(data[6:])
+
+    @classmethod
+    def extract(cls,content):
+        import HTMLParser
+        if isinstance(content, str):
+            content = content.decode("utf-8", "replace")
+        text = cls()
+        try:
+            text.parser.feed(content)
+            text.parser.close()
+            content = u"".join(text.parts)
+        except HTMLParser.HTMLParseError:
+            content = re.sub(r"<[^>]*>", " ", content)
+        return u" ".join(content.split())
+
+class ConfluenceSearchIndex(object):
+    def __init__(self,filename):
+        import sqlite3
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(title, body, tokenize='porter unicode61')")
+        except sqlite3.OperationalError as err:
+            error_out("Cannot create search index (SQLite needs FTS5 support): %s" % err)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY, space TEXT, title TEXT, "
+                        "parent_id TEXT, version TEXT, url TEXT, modified TEXT)")
+
+    def see(self,page_id):
+        with self.lock:
+            self.seen.add(int(page_id))
+
+    def version(self,page_id):
+        with self.lock:
+            row = self.db.execute("SELECT version FROM pages WHERE id = ?", (int(page_id),)).fetchone()
+        return row[0] if row else None
+
+    def add(self,page):
+        if self.version(page['id']) == str(page['version']):
+            return
+        body = ConfluenceText.extract(page['content'])
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)", (
+             int(page['id']), page['space'], page['title'], page['parentId'],
+             str(page['version']), page['url'], str(page.get('modified', ""))))
+            self.db.execute("DELETE FROM pages_fts WHERE rowid = ?", (int(page['id']),))
+            self.db.execute("INSERT INTO pages_fts (rowid, title, body) VALUES (?, ?, ?)",
+                            (int(page['id']), page['title'], body))
+
+    def prune(self):
+        with self.lock:
+            stale = [page_id for (page_id,) in self.db.execute("SELECT id FROM pages")
+                     if page_id not in self.seen]
+            for page_id in stale:
+                self.db.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+                self.db.execute("DELETE FROM pages_fts WHERE rowid = ?", (page_id,))
+        return len(stale)
+
+    def search(self,query,space_key="",limit=20):
+        sql = ("SELECT pages.id, pages.space, pages.title, pages.url, "
+               "snippet(pages_fts, 1, '[', ']', '...', 12) FROM pages_fts "
+               "JOIN pages ON pages.id = pages_fts.rowid WHERE pages_fts MATCH ?")
+        params = [query]
+        if space_key:
+            sql += " AND pages.space = ?"
+            params.append(space_key)
+        sql += " ORDER BY bm25(pages_fts, 5.0, 1.0) LIMIT ?"
+        params.append(limit)
+        for page_id, space, title, url, snippet in self.db.execute(sql, params):
+            yield {"id": str(page_id), "space": space, "title": title, "url": url, "snippet": snippet}
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+class ConfluenceExport(object):
+    def __init__(self,manifest,incremental=False,archive=None,search_index=None):
+        self.manifest = manifest
+        self.incremental = incremental
+        self.archive = archive
+        self.search_index = search_index
+        self.lock = threading.Lock()
+        self.counts = {"saved": 0, "renamed": 0, "unchanged": 0, "removed": 0}
+
+    def count(self,what):
+        with self.lock:
+            self.counts[what] += 1
+
+    def unchanged(self,entry,page):
+        return (self.incremental and entry is not None
+                and str(page['version']) == entry['version']
+                and os.path.exists(entry['filename']))
+
+    def save(self,token,xml_server,page):
+        entry = self.manifest.see(page['id'])
+        if self.search_index is not None:
+            self.search_index.see(page['id'])
+        wanted_page = ConfluencePage(token,xml_server,page['title'],page['space'],"").get()
+        page_filename = self.manifest.page_filename(wanted_page)
+        if self.search_index is not None:
+            self.search_index.add(wanted_page)
+        if self.archive is not None:
+            self.archive.add(wanted_page,page_filename)
+            self.count("saved")
+            sys.stdout.write("Saved page: %s\n" % page_filename)
+            return
+        if self.unchanged(entry,wanted_page):
+            if entry['filename'] == page_filename:
+                self.count("unchanged")
+                return
+            os.rename(entry['filename'], page_filename)
+            self.manifest.record(wanted_page,page_filename)
+            self.count("renamed")
+            sys.stdout.write("Renamed page: %s -> %s\n" % (entry['filename'], page_filename))
+            return
+        page_content = wanted_page['content']
+        if isinstance(page_content, unicode):
+            page_content = page_content.encode("utf-8")
+        with open(page_filename, "w") as page_file:
+            page_file.write(page_content)
+        if entry and entry['filename'] != page_filename and os.path.exists(entry['filename']):
+            os.remove(entry['filename'])
+        self.manifest.record(wanted_page,page_filename)
+        self.count("saved")
+        sys.stdout.write("Saved page: %s\n" % page_filename)
+
+    def prune(self):
+        for page_id in self.manifest.stale():
+            entry = self.manifest.forget(page_id)
+            if os.path.exists(entry['filename']):
+                os.remove(entry['filename'])
+            self.count("removed")
+            sys.stdout.write("Removed page: %s\n" % entry['filename'])
+
+class ConfluenceTree(object):
+    def __init__(self,directory,space_key,parent_id="0",label="",index_file="",extensions=(".html", ".htm")):
+        self.directory = directory
+        self.space_key = space_key
+        self.parent_id = str(parent_id)
+        self.label = label
+        self.index_file = index_file or os.path.join(directory, ".confluence-publish.json")
+        self.extensions = extensions
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_file) as index_file:
+                self.index = json.load(index_file)["pages"]
+        except IOError:
+            self.index = {}
+        self.ids = {"": self.parent_id}
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "removed": 0}
+
+    def title(self,parent_title,name):
+        if parent_title:
+            return "%s - %s" % (parent_title, name)
+        return name
+
+    def entries(self):
+        entries = []
+        titles = {"": ""}
+        for path, directories, files in os.walk(self.directory):
+            directories.sort()
+            relpath = os.path.relpath(path, self.directory)
+            relpath = "" if relpath == "." else relpath.replace(os.sep, "/") + "/"
+            if relpath:
+                source = os.path.join(path, "index.html")
+                parent = relpath[:-1].rpartition("/")[0]
+                parent = parent + "/" if parent else ""
+                titles[relpath] = self.title(titles[parent],os.path.basename(path))
+                entries.append({"path": relpath, "title": titles[relpath],
+                 "source": source if os.path.exists(source) else None,
+                 "parent": parent})
+            for name in sorted(files):
+                if os.path.splitext(name)[1] not in self.extensions or (relpath and name == "index.html"):
+                    continue
+                entries.append({"path": relpath + name, "title": self.title(titles[relpath],os.path.splitext(name)[0]),
+                 "source": os.path.join(path, name), "parent": relpath})
+        return entries
+
+    def adopt(self,token,xml_server,page):
+        existing = ConfluencePage(token,xml_server,page.name,self.space_key,"")
+        page_id = existing.get_id()
+        with self.lock:
+            indexed = page_id in set(known["id"] for known in self.index.values())
+        if indexed or self.label not in existing.get_labels():
+            raise ValueError("a page titled %s that publishtree does not manage already exists" % page.name)
+        page.page_id = page_id
+
+    def count(self,what):
+        with self.lock:
+            self.counts[what] += 1
+
+    def publish(self,token,xml_server,entry):
+        with self.lock:
+            parent_id = self.ids.get(entry["parent"])
+            known = self.index.get(entry["path"])
+        if parent_id is None:
+            raise ValueError("parent page %s was not published" % entry["parent"])
+        import hashlib
+        content = open(entry["source"], "rb").read() if entry["source"] else ""
+        digest = hashlib.sha1(content).hexdigest()
+        if known and (known["sha1"], known["title"], known["parentId"]) == (digest, entry["title"], parent_id):
+            with self.lock:
+                self.ids[entry["path"]] = known["id"]
+            self.count("unchanged")
+            return
+        page = ConfluencePage(token,xml_server,entry["title"],self.space_key,content,label=self.label)
+        if known:
+            page.page_id = known["id"]
+            published = page.update(content,parent_id)
+            self.count("updated")
+        else:
+            try:
+                published = page.add(parent_id)
+                self.count("created")
+            except xmlrpclib.Fault as err:
+                if "already exists" not in err.faultString:
+                    raise
+                self.adopt(token,xml_server,page)
+                published = page.update(content,parent_id)
+                self.count("updated")
+        with self.lock:
+            self.ids[entry["path"]] = published["id"]
+            self.index[entry["path"]] = {"id": published["id"], "title": entry["title"],
+             "parentId": parent_id, "sha1": digest}
+        sys.stdout.write("Published page: %s\n" % entry["path"])
+
+    def remove(self,token,xml_server,path):
+        page_id = self.index[path]["id"]
+        try:
+            xml_server.confluence2.removePage(token, page_id)
+        except xmlrpclib.Fault as err:
+            if "does not exist" not in err.faultString:
+                raise
+        else:
+            self.count("removed")
+            sys.stdout.write("Removed page: %s\n" % path)
+        page_cache.invalidate(page_id)
+        with self.lock:
+            del self.index[path]
+
+    def save(self):
+        with open(self.index_file + ".tmp", "w") as index_file:
+            json.dump({"pages": self.index}, index_file, indent=1, sort_keys=True)
+        os.rename(self.index_file + ".tmp", self.index_file)
+
+class ConfluenceCopy(object):
+    def __init__(self,origin,name,space_key,parent_id="0",label="",prefix=""):
+        self.origin = origin
+        self.name = name
+        self.space_key = space_key
+        self.parent_id = str(parent_id)
+        self.label = label
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.children = collections.defaultdict(list)
+        self.ids = {}
+
+    def add_descendants(self,pages):
+        for page in pages:
+            self.children[page['parentId']].append(page)
+
+    def levels(self):
+        level = [self.origin]
+        while level:
+            yield level
+            level = [child for page in level for child in self.children[page['id']]]
+
+    def title(self,page):
+        if page['id'] == self.origin['id']:
+            return self.name
+        return self.prefix + page['title']
+
+    def count(self):
+        return sum(len(level) for level in self.levels())
+
+    def plan(self,stream):
+        for depth, level in enumerate(self.levels()):
+            for page in level:
+                stream.write("%s%s -> %s\n" % ("  " * depth, page['title'], self.title(page)))
+
+    def copy(self,token,xml_server,page):
+        with self.lock:
+            if page['id'] == self.origin['id']:
+                parent_id = self.parent_id
+            elif page['parentId'] in self.ids:
+                parent_id = self.ids[page['parentId']]
+            else:
+                raise ValueError("parent page was not copied")
+        origin_page = ConfluencePage(token,xml_server,page['title'],page['space'],"",page_id=page['id'])
+        labels = origin_page.get_labels()
+        if self.label and self.label not in labels:
+            labels.append(self.label)
+        copy_page = ConfluencePage(token,xml_server,self.title(page),self.space_key,
+         origin_page.get_content(),label=" ".join(labels))
+        copied = copy_page.add(parent_id)
+        with self.lock:
+            self.ids[page['id']] = copied["id"]
+        sys.stdout.write("%s\n" % copied["url"])
+
+class ConfluenceIdentities(object):
+    def __init__(self,filename,managed_groups=None):
+        self.users = {}
+        with open(filename) as identities:
+            for line_number, line in enumerate(identities, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                user = json.loads(line)
+                if not user.get("name"):
+                    raise ValueError("line %d: user without a name" % line_number)
+                user["groups"] = set(user.get("groups", ()))
+                self.users[user["name"]] = user
+        if managed_groups:
+            self.managed = set(managed_groups)
+        else:
+            self.managed = set(group for user in self.users.values() for group in user["groups"])
+            self.managed.discard("confluence-users")
+        self.lock = threading.Lock()
+        self.active = set()
+        self.inactive = set()
+        self.groups = set()
+        self.current = {}
+
+    def read(self,token,xml_server,item):
+        if item == ("users",):
+            active = set(ConfluenceUser(token,xml_server,"users").iter_all())
+            with self.lock:
+                self.active = active
+        elif item == ("groups",):
+            groups = set(ConfluenceGroup(token,xml_server,"groups").get_all())
+            with self.lock:
+                self.groups = groups
+        else:
+            user = ConfluenceUser(token,xml_server,item[1])
+            if item[0] == "inactive":
+                try:
+                    user.get_info()
+                except xmlrpclib.Fault:
+                    return
+                with self.lock:
+                    self.inactive.add(item[1])
+            groups = set(user.get_groups())
+            with self.lock:
+                self.current[item[1]] = groups
+
+    def changes(self,deactivate=False,keep=()):
+        wanted = set(self.users)
+        changes = [("addgroup", group) for group in sorted(self.managed - self.groups)]
+        changes.extend(("adduser", name) for name in sorted(wanted - self.active - self.inactive))
+        changes.extend(("reactivateuser", name) for name in sorted(wanted & self.inactive))
+        if deactivate:
+            changes.extend(("deactivateuser", name) for name in sorted(self.active - wanted - set(keep)))
+        for name in sorted(wanted):
+            desired = self.users[name]["groups"] & self.managed
+            current = self.current.get(name, set()) & self.managed
+            changes.extend(("addusertogroup", name, group) for group in sorted(desired - current))
+            changes.extend(("removeuserfromgroup", name, group) for group in sorted(current - desired))
+        return changes
+
+    def apply(self,token,xml_server,change):
+        if change[0] == "addgroup":
+            ConfluenceGroup(token,xml_server,change[1]).add()
+        elif change[0] == "adduser":
+            user = self.users[change[1]]
+            password = user.get("password") or os.urandom(18).encode("base64").strip()
+            ConfluenceUser(token,xml_server,change[1]).create(user.get("fullname", change[1]),user.get("email", ""),password)
+        elif change[0] == "deactivateuser":
+            ConfluenceUser(token,xml_server,change[1]).deactivate()
+        elif change[0] == "reactivateuser":
+            ConfluenceUser(token,xml_server,change[1]).reactivate()
+        elif change[0] == "addusertogroup":
+            ConfluenceUser(token,xml_server,change[1]).add_to_group(change[2])
+        elif change[0] == "removeuserfromgroup":
+            ConfluenceUser(token,xml_server,change[1]).remove_from_group(change[2])
+        sys.stdout.write("%s\n" % " ".join(change))
+
+class ConfluenceRows(object):
+    def __init__(self,output_format,fields,delimiter=", "):
+        self.output_format = output_format
+        self.fields = fields
+        self.delimiter = delimiter
+        self.lock = threading.Lock()
+        if self.output_format in ("csv", "tsv"):
+            self.write_values(self.fields)
+
+    def encode(self,value):
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return str(value)
+
+    def write(self,row):
+        if self.output_format == "jsonl":
+            with self.lock:
+                sys.stdout.write(json.dumps(collections.OrderedDict((field, row[field]) for field in self.fields)) + "\n")
+                sys.stdout.flush()
+        else:
+            self.write_values([row[field] for field in self.fields])
+
+    def write_all(self,rows):
+        for row in rows:
+            self.write(row)
+
+    def write_values(self,values):
+        values = [self.encode(value) for value in values]
+        with self.lock:
+            if self.output_format == "text":
+                sys.stdout.write(self.delimiter.join(values) + "\n")
+            else:
+                import csv
+                delimiter = "\t" if self.output_format == "tsv" else ","
+                csv.writer(sys.stdout, delimiter=delimiter, lineterminator="\n").writerow(values)
+            sys.stdout.flush()
+
+class ConfluenceCommand(object):
+    def __init__(self,name,help,run,arguments=(),connect=True,local=False,aliases=()):
+        self.name = name
+        self.help = help
+        self.run = run
+        self.arguments = arguments
+        self.connect = connect
+        self.local = local
+        self.aliases = aliases
+
+    def add_arguments(self,parser):
+        for argument in self.arguments:
+            if isinstance(argument, list):
+                group = parser.add_mutually_exclusive_group()
+                for flags, options in argument:
+                    group.add_argument(*flags, **options)
+            else:
+                flags, options = argument
+                parser.add_argument(*flags, **options)
+
+class ConfluenceCommandParser(argparse.ArgumentParser):
+    def __init__(self,command=None,**kwargs):
+        argparse.ArgumentParser.__init__(self, **kwargs)
+        self.command = command
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def parse_known_args(self,args=None,namespace=None):
+        with self.lock:
+            if not self.loaded:
+                self.command.add_arguments(self)
+                self.loaded = True
+        return argparse.ArgumentParser.parse_known_args(self, args, namespace)
+
+def Argument(*flags, **options):
+    return flags, options
+
+def Exclusive(*arguments):
+    return list(arguments)
+
+def Jobs(value):
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: %r" % value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %d" % jobs)
+    return jobs
+
+def error_out(error_message):
+    print("Error: ")
+    print(error_message)
+    exit()
+
+def BuildParser():
+    parser = argparse.ArgumentParser(description="Confluence wiki API")
+    parser.add_argument("-w", "--wikiurl", help="Wiki URL (only FQDN, no / and such)")
+    parser.add_argument("-u", "--username", help="Login Username")
+    parser.add_argument("-p", "--password", help="Login Password")
+    parser.add_argument("-v", "--verbose", help="Enable debug logging", action="store_true")
+    parser.add_argument("--connect-timeout", help="Seconds to wait for a connection to the wiki", type=float)
+    parser.add_argument("--read-timeout", help="Seconds to wait for a response from the wiki", type=float)
+    parser.add_argument("--pool-size", help="Number of idle connections to keep open", type=int, default=16)
+    parser.add_argument("--gzip", help="Compress large requests (the server must accept gzip request bodies)", action="store_true")
+    parser.add_argument("--retries", help="Times to retry a read call after a transient error", type=int, default=4)
+    parser.add_argument("--max-concurrency", help="Upper limit of concurrent calls to the wiki", type=int, default=16)
+    parser.add_argument("--stats", help="Print a per-method RPC summary at exit", action="store_true")
+    parser.add_argument("--stats-file", help="Write the RPC summary to this file at exit")
+    parser.add_argument("--stats-format", help="Format of --stats-file", choices=("json", "prometheus"), default="json")
+    parser.add_argument("--cache-size", help="Number of pages to keep in the page cache (0 disables it)", type=int, default=256)
+    parser.add_argument("--cache-ttl", help="Seconds a cached page stays valid (0 means no expiry, default: 60 for serve, else 0)", type=float)
+    parser.add_argument("--agent-socket", help="Unix socket of the serve agent", default=os.environ.get(
+     "CONFLUENCE_AGENT_SOCKET", os.path.expanduser("~/.confluence-agent.sock")))
+    parser.add_argument("--agent-timeout", help="Seconds to wait for the serve agent to run a forwarded action", type=float, default=300.0)
+    parser.add_argument("--no-agent", help="Do not forward the action to a running serve agent", action="store_true")
+    subparsers = parser.add_subparsers(dest="action", metavar="action", parser_class=ConfluenceCommandParser)
+    for name, command in commands.items():
+        if name == command.name:
+            subparsers.add_parser(name, help=command.help, command=command)
+        else:
+            subparsers.add_parser(name, command=command)
+
+    return parser, subparsers
+
+def Parser():
+    parser, subparsers = BuildParser()
+    args = parser.parse_args()
+    args.action = commands[args.action].name
+    if commands[args.action].connect and (not args.wikiurl or not args.username or args.password is None):
+        parser.error("arguments -w/--wikiurl, -u/--username and -p/--password are required")
+    return args
+
+def Content(args):
+    if not hasattr(args, 'file') or not hasattr(args, 'stdin'):
+        content = ""
+    elif args.file:
+        try:
+            content = open(args.file, 'rb').read()
+        except:
+            error = "Cannot open file: ", args.file
+            raise
+    elif args.stdin:
+        content = sys.stdin.read()
+    else:
+        content = ""
+    return content
+
+def Server(args):
+    wiki_url = args.wikiurl + "/rpc/xmlrpc"
+    transport = ConfluenceTransport(wiki_url.startswith("https://"),args.connect_timeout,
+                                    args.read_timeout,args.gzip)
+    return ConfluenceServer(xmlrpclib.Server(wiki_url, transport=transport),transport,wiki_url)
+
+def Connect(args):
+    xml_server = Server(args)
+    scheduler.relogin = lambda: ConfluenceAuth(Server(args),args.username,args.password).login()
+    try:
+        token = ConfluenceAuth(xml_server,args.username,args.password).login()
+    except xmlrpclib.Fault as err:
+        error_out("%d: %s" % ( err.faultCode, err.faultString))
+    return {"token":token,"xml_server":xml_server}
+
+class ConfluenceOutput(object):
+    def __init__(self,stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def capture(self):
+        self.local.buffer = StringIO.StringIO()
+
+    def release(self):
+        output = self.local.buffer.getvalue()
+        del self.local.buffer
+        return output
+
+    def current(self):
+        return getattr(self.local, "buffer", None)
+
+    def attach(self,buffer):
+        self.local.buffer = buffer
+
+    def write(self,data):
+        buffer = self.current()
+        if buffer is None:
+            self.stream.write(data)
+        else:
+            with self.lock:
+                buffer.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+class ConfluenceBatch(object):
+    options = ("wikiurl", "username", "password", "verbose", "connect_timeout", "read_timeout", "pool_size",
+     "gzip", "retries", "max_concurrency", "stats", "stats_file", "stats_format", "cache_size", "cache_ttl",
+     "agent_socket", "agent_timeout", "no_agent")
+
+    def __init__(self,args,results):
+        self.args = args
+        self.results = results
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.parser, self.subparsers = BuildParser()
+        for subparser in self.subparsers.choices.values():
+            subparser.error = self.error
+
+    def error(self,message):
+        raise ValueError(message)
+
+    def parse(self,line):
+        if line.startswith("{"):
+            request = json.loads(line)
+            argv = [request.pop("action")]
+            content = request.pop("content", None)
+            for key, value in sorted(request.items()):
+                if value is True:
+                    argv.append("--" + key)
+                elif value is not False and value is not None:
+                    argv.extend(("--" + key, unicode(value)))
+        else:
+            import shlex
+            argv = shlex.split(line)
+            content = None
+        if not argv or argv[0] not in self.subparsers.choices or argv[0] in ("batch", "serve"):
+            raise ValueError("unknown action: %s" % (argv[:1] or [""])[0])
+        line_args = argparse.Namespace(**dict((option, getattr(self.args, option)) for option in self.options))
+        self.subparsers.choices[argv[0]].parse_args(argv[1:], namespace=line_args)
+        line_args.action = commands[argv[0]].name
+        if content is None:
+            content = Content(line_args)
+        return line_args, content
+
+    def run(self,token,xml_server,item):
+        line_number, line = item
+        result = {"line": line_number, "input": line, "ok": False}
+        sys.stdout.capture()
+        try:
+            line_args, content = self.parse(line)
+            result["action"] = line_args.action
+            RunAction(token,xml_server,line_args,content)
+            result["ok"] = True
+        except xmlrpclib.Fault as err:
+            result["error"] = "%d: %s" % (err.faultCode, err.faultString)
+        except (Exception, SystemExit) as err:
+            result["error"] = str(err)
+        finally:
+            result["output"] = sys.stdout.release()
+        with self.lock:
+            self.failed += int(not result["ok"])
+            self.results.write(json.dumps(result, sort_keys=True) + "\n")
+            self.results.flush()
+
+def RunBatch(token,xml_server,args,content):
+    script = open(args.script) if args.script else sys.stdin
+    results = open(args.results, "w") if args.results else sys.stdout
+    sys.stdout = ConfluenceOutput(sys.stdout)
+    try:
+        batch = ConfluenceBatch(args,results)
+        pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,batch.run)
+        for line_number, line in enumerate(script, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                pool.submit((line_number,line))
+        summary = pool.join()
+    finally:
+        sys.stdout = sys.stdout.stream
+    logger.info("Ran %d actions in %.1fs (%.1f actions/sec): %d succeeded, %d failed" % (
+     summary["done"], summary["elapsed"], summary["rate"], summary["done"] - batch.failed, batch.failed))
+    if batch.failed:
+        sys.exit(1)
+
+class ConfluenceAgent(object):
+    def __init__(self,path,timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self.logger = logging.getLogger(
+            __name__ + '.'+ self.__class__.__name__
+        )
+
+    def connect(self):
+        agent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        agent.settimeout(self.timeout)
+        try:
+            agent.connect(self.path)
+        except socket.error:
+            agent.close()
+            return None
+        return agent
+
+    def forward(self,argv,content):
+        agent = self.connect()
+        if agent is None:
+            return None
+        try:
+            agent.sendall(json.dumps({"argv": argv, "content": content}) + "\n")
+            response = json.loads(agent.makefile().readline() or "null")
+            if response is None:
+                raise ValueError("connection closed without a response")
+        except (socket.error, ValueError) as err:
+            return {"status": 1, "output": "", "error": "agent at %s did not answer: %s" % (self.path, err)}
+        finally:
+            agent.close()
+        if "refused" in response:
+            self.logger.debug("Agent at {} refused the action: {}".format(self.path, response["refused"]))
+            return None
+        return response
+
+    def error(self,message):
+        raise ValueError(message)
+
+    def handle(self,request,client_address,server):
+        line = request.makefile("rb").readline()
+        if line:
+            request.sendall(json.dumps(self.run(line)) + "\n")
+
+    def run(self,line):
+        try:
+            request = json.loads(line)
+            args = self.parser.parse_args(request["argv"])
+        except (ValueError, KeyError, SystemExit) as err:
+            return {"refused": "invalid request: %s" % err}
+        if (args.wikiurl, args.username, args.password) != self.identity:
+            return {"refused": "agent is logged in to another wiki or as another user"}
+        args.action = commands[args.action].name
+        if commands[args.action].local:
+            return {"refused": "%s runs locally" % args.action}
+        response = {"status": 0}
+        sys.stdout.capture()
+        sys.stderr.capture()
+        try:
+            Actions(self.token,Server(args),args,request.get("content") or "")
+        except SystemExit as err:
+            response["status"] = err.code or 0
+        except Exception as err:
+            self.logger.exception("Action {} failed".format(args.action))
+            response["status"] = 1
+            response["error"] = "%s: %s" % (err.__class__.__name__, err)
+        finally:
+            response["output"] = sys.stdout.release()
+            response["log"] = sys.stderr.release()
+        return response
+
+    def serve(self,token,args):
+        self.token = token
+        self.identity = (args.wikiurl, args.username, args.password)
+        self.parser, subparsers = BuildParser()
+        for subparser in [self.parser] + subparsers.choices.values():
+            subparser.error = self.error
+        agent = self.connect()
+        if agent is not None:
+            agent.close()
+            error_out("An agent is already listening on %s" % self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        import SocketServer
+        umask = os.umask(077)
+        try:
+            server = SocketServer.ThreadingUnixStreamServer(self.path, self.handle)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        sys.stdout = ConfluenceOutput(sys.stdout)
+        sys.stderr = ConfluenceOutput(sys.stderr)
+        for handler in logger.handlers:
+            handler.stream = sys.stderr
+        logger.info("Serving {} as {} on {}".format(args.wikiurl, args.username, self.path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout = sys.stdout.stream
+            sys.stderr = sys.stderr.stream
+            for handler in logger.handlers:
+                handler.stream = sys.stderr
+            server.server_close()
+            os.unlink(self.path)
+
+def RunAddPage(token,xml_server,args,content):
+    logger.debug('Command: "addpage", args.name = "{}", args.label = "{}"'.format(
+        args.name, args.label))
+    new_page = ConfluencePage(
+        token,xml_server,args.name,args.spacekey,content,label=args.label)
+    new_page.add(args.parentpage)
+    print(new_page.get()["url"])
+
+def RunCopyPage(token,xml_server,args,content):
+    target_space = args.target_space or args.spacekey
+    if args.recursive and target_space == args.spacekey and not args.prefix:
+        error_out("Copying a page tree within a space needs --prefix to keep titles unique")
+    origin_page = ConfluencePage(token,xml_server,args.origin,args.spacekey,"")
+    copy = ConfluenceCopy(origin_page.get(),args.name,target_space,args.parentpage,args.label,args.prefix)
+    if args.recursive:
+        copy.add_descendants(origin_page.iter_descendants())
+    if args.dry_run:
+        copy.plan(sys.stdout)
+        print("Would copy %d pages from %s to %s with about %d calls" % (
+         copy.count(), args.spacekey, target_space, 4 * copy.count() + int(args.recursive)))
+        return
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,copy.copy)
+    for level in copy.levels():
+        for page in level:
+            pool.submit(page)
+        pool.wait()
+    pool.join()
+    for page, err in pool.failures:
+        logger.error("Could not copy page %s: %s" % (page['title'], err))
+
+def RunUpdatePage(token,xml_server,args,content):
+    update_page = ConfluencePage(token,xml_server,args.name,args.spacekey,content,label=args.label)
+    print(update_page.update(content,args.parentpage,args.skip_unchanged)['url'])
+
+def RunGetPageContent(token,xml_server,args,content):
+    get_page = ConfluencePage(token,xml_server,args.name,args.spacekey,content).get_content()
+    print(get_page)
+
+def RunGetPageSummary(token,xml_server,args,content):
+    page = ConfluencePage(token,xml_server,args.name,args.spacekey,content).get()
+    print args.delimiter.join((
+     page['id'], page['space'], page['parentId'], page['title'], page['url']))
+
+def RunListPages(token,xml_server,args,content):
+    if args.spacekey == "":
+        spaces = ConfluenceSpace(token,xml_server).get_all()
+    else:
+        spaces = [ConfluenceSpace(token,xml_server).get_by_key(args.spacekey)]
+    rows = ConfluenceRows(args.format,("id", "space", "parentId", "title", "url"),args.delimiter)
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,
+     lambda token, xml_server, space_key: rows.write_all(ConfluenceSpace(token,xml_server).iter_pages(space_key)))
+    for space in spaces:
+        pool.submit(space['key'])
+    pool.join()
+    for space_key, err in pool.failures:
+        logger.error("Could not list space %s: %s" % (space_key, err))
+
+def RunRemovePage(token,xml_server,args,content):
+    removed_page = ConfluencePage(token,xml_server,args.name,args.spacekey,"").remove()
+
+def RunAddSpace(token,xml_server,args,content):
+    add_space = ConfluenceSpace(token,xml_server).create(args.spacekey,args.name,args.description)
+
+def RunRemoveSpace(token,xml_server,args,content):
+    remove_space = ConfluenceSpace(token,xml_server).remove(args.spacekey)
+
+def RunListSpaces(token,xml_server,args,content):
+    all_spaces = ConfluenceSpace(token,xml_server).get_all()
+    ConfluenceRows(args.format,("key", "name", "url")).write_all(all_spaces)
+
+def RunGetAllPages(token,xml_server,args,content):
+    if args.archive and args.incremental:
+        error_out("--archive and --incremental cannot be combined")
+    archive = ConfluenceArchive(args.archive,args.split_by_space) if args.archive else None
+    search_index = ConfluenceSearchIndex(args.search_index) if args.search_index else None
+    export = ConfluenceExport(ConfluenceManifest(args.manifest),args.incremental,archive,search_index)
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,export.save)
+    try:
+        all_spaces = ConfluenceSpace(token,xml_server).get_all()
+        for space in all_spaces:
+            all_pages = ConfluenceSpace(token,xml_server).iter_pages(space['key'])
+            print("Saving space: %s" % space['name'])
+            print("------------")
+            for page in all_pages:
+                pool.submit(page)
+        summary = pool.join()
+    except BaseException:
+        if archive:
+            pool.join()
+            archive.abort()
+        if search_index:
+            search_index.close()
+        raise
+    complete = summary["done"] > 0 and not summary["failed"]
+    if (args.incremental or search_index) and not complete:
+        print("Not removing deleted pages: %s" % (
+         "some pages failed" if summary["failed"] else "no pages were seen"))
+    if search_index:
+        if complete and search_index.prune():
+            print("Removed deleted pages from the search index")
+        search_index.close()
+    if archive:
+        archive.close()
+    else:
+        if args.incremental and complete:
+            export.prune()
+        export.manifest.save()
+    for page, err in pool.failures:
+        title = page['title']
+        if isinstance(title, unicode):
+            title = title.encode("utf-8")
+        print("Could not save page: %s: %s" % (title, err))
+    print("Processed %d pages in %.1fs (%.1f pages/sec): %d saved, %d renamed, %d unchanged, %d removed, %d failures" % (
+     summary["done"], summary["elapsed"], summary["rate"], export.counts["saved"],
+     export.counts["renamed"], export.counts["unchanged"], export.counts["removed"],
+     summary["failed"]))
+
+def RunAddUser(token,xml_server,args,content):
+    add_user = ConfluenceUser(token,xml_server,args.newusername).create(args.fullname,args.email,args.userpassword)
+
+def RunRemoveUser(token,xml_server,args,content):
+    remove_user = ConfluenceUser(token,xml_server,args.newusername).remove()
+
+def RunDeactivateUser(token,xml_server,args,content):
+    deactivate_user = ConfluenceUser(token,xml_server,args.newusername).deactivate()
+
+def RunReactivateUser(token,xml_server,args,content):
+    reactivate_user = ConfluenceUser(token,xml_server,args.newusername).reactivate()
+
+def RunChangeUserPassword(token,xml_server,args,content):
+    change_pass = ConfluenceUser(token,xml_server,args.newusername).change_password(args.userpassword)
+
+def RunListUserInfo(token,xml_server,args,content):
+    user_info = ConfluenceUser(token,xml_server,args.newusername).get_info()
+    for key,value in user_info.items():
+        print(("%s: %s") % (key,value))
+
+def RunAddGroup(token,xml_server,args,content):
+    add_group = ConfluenceGroup(token,xml_server,args.groupname).add()
+
+def RunRemoveGroup(token,xml_server,args,content):
+    remove_group = ConfluenceGroup(token,xml_server,args.groupname).remove()
+
+def RunAddUserToGroup(token,xml_server,args,content):
+    add_user_to_group = ConfluenceUser(token,xml_server,args.newusername).add_to_group(args.groupname)
+
+def RunRemoveUserFromGroup(token,xml_server,args,content):
+    remove_user_from_group = ConfluenceUser(token,xml_server,args.newusername).remove_from_group(args.groupname)
+
+def RunListGroups(token,xml_server,args,content):
+    allgroups = ConfluenceGroup(token,xml_server,"users").get_all()
+    ConfluenceRows(args.format,("name",)).write_all({"name": group} for group in allgroups)
+
+def RunListUsers(token,xml_server,args,content):
+    allusers = ConfluenceUser(token,xml_server,"users").iter_all()
+    ConfluenceRows(args.format,("name",)).write_all({"name": user} for user in allusers)
+
+def RunListUserGroups(token,xml_server,args,content):
+    user_groups = ConfluenceUser(token,xml_server,args.newusername).get_groups()
+    for group in user_groups:
+        print(group)
+
+def RunPublishTree(token,xml_server,args,content):
+    tree = ConfluenceTree(args.directory,args.spacekey,args.parentpage,args.label,args.index)
+    entries = tree.entries()
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,tree.publish)
+    failures = []
+    try:
+        for depth in sorted(set(entry["path"].rstrip("/").count("/") for entry in entries)):
+            for entry in entries:
+                if entry["path"].rstrip("/").count("/") == depth:
+                    pool.submit(entry)
+            pool.wait()
+        if args.delete:
+            paths = set(entry["path"] for entry in entries)
+            for path in sorted(tree.index, key=lambda path: -path.rstrip("/").count("/")):
+                if path not in paths:
+                    try:
+                        tree.remove(token,xml_server,path)
+                    except xmlrpclib.Fault as err:
+                        failures.append((path, "%d: %s" % (err.faultCode, err.faultString)))
+    finally:
+        summary = pool.join()
+        tree.save()
+    for entry, err in pool.failures:
+        print("Could not publish page: %s: %s" % (entry["path"], err))
+    for path, err in failures:
+        print("Could not remove page: %s: %s" % (path, err))
+    print("Published %d pages in %.1fs: %d created, %d updated, %d unchanged, %d removed, %d failures" % (
+     summary["done"], summary["elapsed"], tree.counts["created"], tree.counts["updated"],
+     tree.counts["unchanged"], tree.counts["removed"], summary["failed"] + len(failures)))
+
+def RunSyncIdentities(token,xml_server,args,content):
+    try:
+        identities = ConfluenceIdentities(args.file,args.group)
+    except (IOError, ValueError) as err:
+        error_out("Cannot read %s: %s" % (args.file, err))
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,identities.read)
+    pool.submit(("users",))
+    pool.submit(("groups",))
+    pool.wait()
+    for name in sorted(identities.users):
+        pool.submit(("user" if name in identities.active else "inactive", name))
+    pool.join()
+    if pool.failures:
+        for item, err in pool.failures:
+            print("Could not read %s: %s" % (" ".join(item), err))
+        error_out("Not changing anything, the current state is incomplete")
+    changes = identities.changes(args.deactivate,keep=(args.username,))
+    if args.dry_run:
+        for change in changes:
+            print(" ".join(change))
+        print("Would make %d changes, one call each" % len(changes))
+        return
+    pool = ConfluenceWorkerPool(token,lambda: Server(args),args.jobs,identities.apply)
+    for change in changes:
+        if change[0] in ("addgroup", "adduser", "reactivateuser"):
+            pool.submit(change)
+    pool.wait()
+    for change in changes:
+        if change[0] not in ("addgroup", "adduser", "reactivateuser"):
+            pool.submit(change)
+    summary = pool.join()
+    for change, err in pool.failures:
+        print("Could not %s: %s" % (" ".join(change), err))
+    print("Made %d changes in %.1fs: %d failures" % (
+     summary["done"], summary["elapsed"], summary["failed"]))
+
+def Text(value):
+    if isinstance(value, unicode):
+        return value
+    import locale
+    encoding = sys.stdin.encoding or locale.getpreferredencoding() or "utf-8"
+    try:
+        return value.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return value.decode("utf-8", "replace")
+
+def RunSearchPages(token,xml_server,args,content):
+    import sqlite3
+    if not os.path.exists(args.search_index):
+        error_out("Search index %s does not exist, build it with getallpages --search-index" % args.search_index)
+    search_index = ConfluenceSearchIndex(args.search_index)
+    rows = ConfluenceRows(args.format,("id", "space", "title", "url", "snippet"),args.delimiter)
+    try:
+        rows.write_all(search_index.search(Text(args.query),Text(args.spacekey or ""),args.limit))
+    except sqlite3.OperationalError as err:
+        error_out("Invalid search query: %s" % err)
+
+def RunServe(token,xml_server,args,content):
+    ConfluenceAgent(args.agent_socket).serve(token,args)
+
+commands = collections.OrderedDict()
+for command in (
+    ConfluenceCommand('addpage', 'Add a page', RunAddPage, (
+        Argument("-n", "--name", help="(New) page name", required=True),
+        Argument("-P", "--parentpage", help="Parent page ID", default="0"),
+        Argument("-l", "--label", help="Page label", default="created_via_api"),
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Exclusive(
+            Argument("-f", "--file", help="Read content from this file"),
+            Argument("-S", "--stdin", help="Read content from STDIN", action="store_true")))),
+    ConfluenceCommand('copypage', 'Copy a page', RunCopyPage, (
+        Argument("-n", "--name", help="(New) page name", required=True),
+        Argument("-P", "--parentpage", help="Parent page ID", default="0"),
+        Argument("-l", "--label", help="Page label", default="created_via_api"),
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Argument("-o", "--origin", help="Origin page name", required=True),
+        Argument("-t", "--target-space", help="Space Key to copy into (default: the origin space)", default=""),
+        Argument("-r", "--recursive", help="Also copy all descendants of the origin page", action="store_true"),
+        Argument("--prefix", help="Prefix for the titles of copied descendants", default=""),
+        Argument("-j", "--jobs", help="Number of sibling pages to copy concurrently", type=Jobs, default=1),
+        Argument("--dry-run", help="Only print what would be copied", action="store_true"))),
+    ConfluenceCommand('updatepage', 'Update a page', RunUpdatePage, (
+        Argument("-n", "--name", help="Page name", required=True),
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Argument("-P", "--parentpage", help="Parent page ID (default: keep current parent)", default="0"),
+        Argument("-l", "--label", help="Page label", default="created_via_api"),
+        Argument("-k", "--skip-unchanged", help="Do not write the page if its content is unchanged", action="store_true"),
+        Exclusive(
+            Argument("-f", "--file", help="Read content from this file"),
+            Argument("-S", "--stdin", help="Read content from STDIN", action="store_true")))),
+    ConfluenceCommand('listpages', 'List pages in one or all spaces', RunListPages, (
+        Argument("-s", "--spacekey", help="Space Key", default=""),
+        Argument("-d", "--delimiter", help="Field delimiter", default=", "),
+        Argument("-F", "--format", help="Output format", choices=("text", "jsonl", "csv", "tsv"), default="text"),
+        Argument("-j", "--jobs", help="Number of spaces to list concurrently", type=Jobs, default=1))),
+    ConfluenceCommand('removepage', 'Remove a page', RunRemovePage, (
+        Argument("-n", "--name", help="Page name", required=True),
+        Argument("-s", "--spacekey", help="Space Key", required=True))),
+    ConfluenceCommand('getpagecontent', 'Get page content', RunGetPageContent, (
+        Argument("-n", "--name", help="Page name", required=True),
+        Argument("-s", "--spacekey", help="Space Key", required=True))),
+    ConfluenceCommand('getpagesummary', 'Get page summary', RunGetPageSummary, (
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Argument("-n", "--name", help="Page name", required=True),
+        Argument("-d", "--delimiter", help="Field delimiter", default=", "))),
+    ConfluenceCommand('listspaces', 'List all spaces', RunListSpaces, (
+        Argument("-F", "--format", help="Output format", choices=("text", "jsonl", "csv", "tsv"), default="text"),)),
+    ConfluenceCommand('addspace', 'Add a space', RunAddSpace, (
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Argument("-n", "--name", help="Space name", required=True),
+        Argument("-D", "--description", help="Space description", default=""))),
+    ConfluenceCommand('removespace', 'Remove a space', RunRemoveSpace, (
+        Argument("-s", "--spacekey", help="Space Key", required=True),)),
+    ConfluenceCommand('adduser', 'Add a user', RunAddUser, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),
+        Argument("-N", "--fullname", help="Full name for new user", required=True),
+        Argument("-E", "--email", help="Email address for new user", required=True),
+        Argument("-X", "--userpassword", help="Password for new user", required=True))),
+    ConfluenceCommand('removeuser', 'Remove a user', RunRemoveUser, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),)),
+    ConfluenceCommand('deactivateuser', 'Deactivate a user', RunDeactivateUser, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),)),
+    ConfluenceCommand('reactivateuser', 'Reactivate a user', RunReactivateUser, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),)),
+    ConfluenceCommand('changeuserpassword', 'Change user password', RunChangeUserPassword, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),
+        Argument("-X", "--userpassword", help="Password for user", required=True))),
+    ConfluenceCommand('listuserinfo', 'Show user details', RunListUserInfo, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),)),
+    ConfluenceCommand('addgroup', 'Add a goup', RunAddGroup, (
+        Argument("-G", "--groupname", help="Group name to perform action on.", required=True),)),
+    ConfluenceCommand('removegroup', 'Remove a goup', RunRemoveGroup, (
+        Argument("-G", "--groupname", help="Group name to perform action on.", required=True),)),
+    ConfluenceCommand('listgroups', 'List all goup', RunListGroups, (
+        Argument("-F", "--format", help="Output format", choices=("text", "jsonl", "csv", "tsv"), default="text"),)),
+    ConfluenceCommand('listusers', 'List all users', RunListUsers, (
+        Argument("-F", "--format", help="Output format", choices=("text", "jsonl", "csv", "tsv"), default="text"),)),
+    ConfluenceCommand('getallpages', 'Save all pages to local files.', RunGetAllPages, (
+        Argument("-j", "--jobs", help="Number of pages to fetch concurrently", type=Jobs, default=1),
+        Argument("-m", "--manifest", help="Page version manifest file", default=".confluence-manifest.json"),
+        Argument("-i", "--incremental", help="Only save pages changed since the last run, remove deleted pages", action="store_true"),
+        Argument("-a", "--archive", help="Save all pages into this .tar, .tar.gz, .tar.bz2 or .zip file"),
+        Argument("--split-by-space", help="Write one archive per space", action="store_true"),
+        Argument("-x", "--search-index", help="Build or update a full-text search index in this SQLite file")),
+     local=True),
+    ConfluenceCommand('searchpages', 'Search the local full-text index built by getallpages', RunSearchPages, (
+        Argument("-x", "--search-index", help="SQLite search index file", required=True),
+        Argument("-q", "--query", help="FTS5 query, e.g. 'backup AND restore'", required=True),
+        Argument("-s", "--spacekey", help="Only search this space", default=""),
+        Argument("-n", "--limit", help="Maximum number of results", type=int, default=20),
+        Argument("-d", "--delimiter", help="Field delimiter", default=", "),
+        Argument("-F", "--format", help="Output format", choices=("text", "jsonl", "csv", "tsv"), default="text")),
+     connect=False, local=True),
+    ConfluenceCommand('addusertogroup', 'Add user to a group', RunAddUserToGroup, (
+        Argument("-G", "--groupname", help="Group name to perform action on.", required=True),
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True))),
+    ConfluenceCommand('removeuserfromgroup', 'Remove user from a group', RunRemoveUserFromGroup, (
+        Argument("-G", "--groupname", help="Group name to perform action on.", required=True),
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True)),
+     aliases=('removeusergromgroup',)),
+    ConfluenceCommand('listusergroups', 'List groups user is in', RunListUserGroups, (
+        Argument("-U", "--newusername", help="Username to perform action on.", required=True),)),
+    ConfluenceCommand('publishtree', 'Publish a directory tree of HTML files as a page tree', RunPublishTree, (
+        Argument("-d", "--directory", help="Directory to publish", required=True),
+        Argument("-s", "--spacekey", help="Space Key", required=True),
+        Argument("-P", "--parentpage", help="Parent page ID", default="0"),
+        Argument("-l", "--label", help="Label that marks pages managed by publishtree", default="publishtree"),
+        Argument("-i", "--index", help="Content hash index file (default: DIRECTORY/.confluence-publish.json)", default=""),
+        Argument("-j", "--jobs", help="Number of sibling pages to publish concurrently", type=Jobs, default=1),
+        Argument("--delete", help="Remove published pages whose source file is gone", action="store_true")),
+     local=True),
+    ConfluenceCommand('syncidentities', 'Make users and group memberships match a JSONL file', RunSyncIdentities, (
+        Argument("-f", "--file", help="JSONL file with one user per line: name, fullname, email and groups", required=True),
+        Argument("-g", "--group", help="Only manage membership of this group (repeatable, default: all groups in the file except confluence-users)", action="append"),
+        Argument("--deactivate", help="Deactivate active users that are not in the file", action="store_true"),
+        Argument("-j", "--jobs", help="Number of calls to run concurrently", type=Jobs, default=1),
+        Argument("--dry-run", help="Only print the changes", action="store_true")),
+     local=True),
+    ConfluenceCommand('batch', 'Run actions from a JSONL or line-oriented script', RunBatch, (
+        Argument("-f", "--file", help="Read actions from this file instead of STDIN", dest="script"),
+        Argument("-o", "--output", help="Write JSONL results to this file instead of STDOUT", dest="results"),
+        Argument("-j", "--jobs", help="Number of actions to run concurrently", type=Jobs, default=1)),
+     local=True),
+    ConfluenceCommand('serve', 'Keep a logged in session and run forwarded actions from a Unix socket', RunServe,
+     local=True),
+    ):
+    for name in (command.name,) + command.aliases:
+        commands[name] = command
+
+def RunAction(token,xml_server,args,content):
+    commands[args.action].run(token,xml_server,args,content)
+
+def Actions(token,xml_server,args,content):
+    try:
+        RunAction(token,xml_server,args,content)
+    except xmlrpclib.Fault as err:
+        print(("Error: %d: %s") % (err.faultCode, err.faultString))
+
+def main():
+    args = Parser()
+    Logging(args.verbose)
+    page_cache.size = args.cache_size
+    if args.cache_ttl is None:
+        args.cache_ttl = 60 if args.action == "serve" else 0
+    page_cache.ttl = args.cache_ttl
+    connection_pool.size = args.pool_size
+    scheduler.retries = args.retries
+    scheduler.concurrency = args.max_concurrency
+    scheduler.limit = float(args.max_concurrency)
+
+    content = Content(args)
+    if not (args.no_agent or args.verbose or args.stats or args.stats_file or commands[args.action].local):
+        try:
+            response = ConfluenceAgent(args.agent_socket,args.agent_timeout).forward(sys.argv[1:],content)
+        except UnicodeDecodeError:
+            response = None
+        if response is not None:
+            sys.stdout.write(response["output"].encode("utf-8"))
+            sys.stderr.write(response.get("log", "").encode("utf-8"))
+            if "error" in response:
+                sys.stderr.write("Error: %s\n" % response["error"].encode("utf-8"))
+            sys.exit(response["status"])
+    try:
+        if not commands[args.action].connect:
+            Actions(None,None,args,content)
+            return
+        server = Connect(args)
+        Actions(server["token"],server["xml_server"],args,content)
+    finally:
+        if args.stats:
+            stats.report(sys.stderr)
+        if args.stats_file:
+            stats.write(args.stats_file,args.stats_format)
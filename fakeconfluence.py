@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# Copyright (C) 2013  Remy van Elst
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys, time, random, argparse, threading, xmlrpclib, SocketServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+NOT_FOUND = "com.atlassian.confluence.rpc.RemoteException: You're not allowed to view that page, or it does not exist."
+BAD_TOKEN = "com.atlassian.confluence.rpc.InvalidSessionException: User not authenticated or session expired. Call login() to open a new session"
+OUTDATED = "com.atlassian.confluence.rpc.RemoteException: You're trying to edit an outdated version of that page."
+
+class FakeRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/rpc/xmlrpc",)
+
+    def setup(self):
+        self.timeout = self.server.instance.idle_timeout or None
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def do_POST(self):
+        fail_rate = self.server.instance.fail_rate
+        if fail_rate and random.random() < fail_rate:
+            self.rfile.read(int(self.headers["content-length"]))
+            self.send_response(503)
+            self.send_header("Content-length", "0")
+            self.end_headers()
+            return
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+class FakeConfluence(object):
+    def __init__(self, url, spaces=2, pages=10, users=10, groups=3,
+                 latency=0.0, jitter=0.0, page_size=2000, fail_rate=0.0, idle_timeout=0.0):
+        self.url = url
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.tokens = set()
+        self.spaces = {}
+        self.pages = {}
+        self.labels = {}
+        self.users = {}
+        self.groups = {"confluence-users": set(), "confluence-administrators": set()}
+        self.next_id = 1000
+        body = ("<p>" + "lorem ipsum dolor sit amet " * (page_size // 27 + 1))[:page_size] + "</p>"
+        for s in range(spaces):
+            key = "SP%d" % s
+            self._add_space(key, "Space %d" % s)
+            parents = ["0"]
+            for p in range(pages):
+                page = self._store(key, "Page %d of %s" % (p, key), body,
+                                   random.Random(p).choice(parents))
+                parents.append(page["id"])
+        for g in range(groups):
+            self.groups["group%d" % g] = set()
+        for u in range(users):
+            name = "user%d" % u
+            self.users[name] = {"name": name, "fullname": "User %d" % u,
+                                "email": "%s@example.org" % name, "active": True}
+            self.groups["confluence-users"].add(name)
+            if groups:
+                self.groups["group%d" % (u % groups)].add(name)
+
+    def _add_space(self, key, name, description=""):
+        self.spaces[key] = {"key": key, "name": name, "description": description,
+                            "url": "%s/display/%s" % (self.url, key)}
+
+    def _store(self, space, title, content, parent_id="0"):
+        self.next_id += 1
+        page = {"id": str(self.next_id), "space": space, "title": title,
+                "parentId": str(parent_id), "content": content, "version": "1",
+                "modified": xmlrpclib.DateTime(time.gmtime()),
+                "url": "%s/display/%s/%s" % (self.url, space, title.replace(" ", "+"))}
+        self.pages[page["id"]] = page
+        return page
+
+    def _summary(self, page):
+        return dict((k, page[k]) for k in ("id", "space", "parentId", "title", "url"))
+
+    def _page(self, token, space_or_id, title=None):
+        if title is None:
+            page = self.pages.get(str(space_or_id))
+        else:
+            page = self._find(space_or_id, title)
+        if page is None:
+            raise xmlrpclib.Fault(0, NOT_FOUND)
+        return page
+
+    def _find(self, space, title):
+        for page in self.pages.values():
+            if page["space"] == space and page["title"] == title:
+                return page
+
+    def _dispatch(self, method, params):
+        with self.lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+        if method.startswith("bench."):
+            return getattr(self, "bench_" + method[6:])(*params)
+        if not method.startswith("confluence2."):
+            raise xmlrpclib.Fault(0, "No such method: %s" % method)
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        name = method[12:]
+        func = getattr(self, "rpc_" + name, None)
+        if func is None:
+            raise xmlrpclib.Fault(0, "No such method: %s" % method)
+        if name != "login" and params[0] not in self.tokens:
+            raise xmlrpclib.Fault(0, BAD_TOKEN)
+        with self.lock:
+            return func(*params)
+
+    def bench_counts(self):
+        return self.counts
+
+    def bench_reset(self):
+        self.counts = {}
+        return True
+
+    def bench_expire(self):
+        self.tokens.clear()
+        return True
+
+    def rpc_login(self, username, password):
+        token = "token-%d" % random.randint(0, 1 << 30)
+        self.tokens.add(token)
+        return token
+
+    def rpc_getSpaces(self, token):
+        return sorted(self.spaces.values(), key=lambda s: s["key"])
+
+    def rpc_getSpace(self, token, key):
+        if key not in self.spaces:
+            raise xmlrpclib.Fault(0, "No space found for space key: %s" % key)
+        return self.spaces[key]
+
+    def rpc_addSpace(self, token, space):
+        self._add_space(space["key"], space["name"], space.get("description", ""))
+        return self.spaces[space["key"]]
+
+    def rpc_removeSpace(self, token, key):
+        self.spaces.pop(key, None)
+        for page_id in [p["id"] for p in self.pages.values() if p["space"] == key]:
+            del self.pages[page_id]
+        return True
+
+    def rpc_getPages(self, token, key):
+        self.rpc_getSpace(token, key)
+        return [self._summary(p) for p in sorted(self.pages.values(), key=lambda p: int(p["id"]))
+                if p["space"] == key]
+
+    def rpc_getChildren(self, token, page_id):
+        return [self._summary(p) for p in self.pages.values() if p["parentId"] == str(page_id)]
+
+    def rpc_getDescendents(self, token, page_id):
+        descendents = []
+        parents = [str(page_id)]
+        while parents:
+            children = [p for p in self.pages.values() if p["parentId"] in parents]
+            descendents.extend(self._summary(p) for p in children)
+            parents = [p["id"] for p in children]
+        return descendents
+
+    def rpc_getPage(self, token, space_or_id, title=None):
+        return self._page(token, space_or_id, title)
+
+    def rpc_storePage(self, token, new):
+        if new.get("id"):
+            page = self._page(token, new["id"])
+            if str(new.get("version")) != page["version"]:
+                raise xmlrpclib.Fault(0, OUTDATED)
+            other = self._find(new["space"], new["title"])
+            if other is not None and other is not page:
+                raise xmlrpclib.Fault(0, "A page already exists with the title %s in the space %s" % (new["title"], new["space"]))
+            page.update(title=new["title"], content=new["content"],
+                        version=str(int(page["version"]) + 1),
+                        modified=xmlrpclib.DateTime(time.gmtime()))
+            if new.get("parentId"):
+                page["parentId"] = str(new["parentId"])
+            return page
+        if new["space"] not in self.spaces:
+            raise xmlrpclib.Fault(0, "No space found for space key: %s" % new["space"])
+        if self._find(new["space"], new["title"]) is not None:
+            raise xmlrpclib.Fault(0, "A page already exists with the title %s in the space %s" % (new["title"], new["space"]))
+        return self._store(new["space"], new["title"], new["content"], new.get("parentId") or "0")
+
+    def rpc_removePage(self, token, page_id):
+        self._page(token, page_id)
+        del self.pages[str(page_id)]
+        self.labels.pop(str(page_id), None)
+        return True
+
+    def rpc_addLabelByName(self, token, names, object_id):
+        self._page(token, object_id)
+        self.labels.setdefault(str(object_id), set()).update(names.replace(",", " ").split())
+        return True
+
+    def rpc_getLabelsById(self, token, object_id):
+        self._page(token, object_id)
+        return [{"name": n, "id": str(i)} for i, n in enumerate(sorted(self.labels.get(str(object_id), ())))]
+
+    def rpc_getGroups(self, token):
+        return sorted(self.groups)
+
+    def rpc_addGroup(self, token, group):
+        self.groups.setdefault(group, set())
+        return True
+
+    def rpc_removeGroup(self, token, group, default_group):
+        self.groups.pop(group, None)
+        return True
+
+    def _user(self, username):
+        if username not in self.users:
+            raise xmlrpclib.Fault(0, "No user found with username: %s" % username)
+        return self.users[username]
+
+    def rpc_addUser(self, token, user, password):
+        if user["name"] in self.users:
+            raise xmlrpclib.Fault(0, "A user with username %s already exists" % user["name"])
+        self.users[user["name"]] = dict(user, active=True)
+        self.groups["confluence-users"].add(user["name"])
+        return True
+
+    def rpc_getUser(self, token, username):
+        user = self._user(username)
+        return {"name": user["name"], "fullname": user["fullname"], "email": user["email"]}
+
+    def rpc_getUserGroups(self, token, username):
+        self._user(username)
+        return sorted(g for g, members in self.groups.items() if username in members)
+
+    def rpc_removeUser(self, token, username):
+        self._user(username)
+        del self.users[username]
+        for members in self.groups.values():
+            members.discard(username)
+        return True
+
+    def rpc_deactivateUser(self, token, username):
+        self._user(username)["active"] = False
+        return True
+
+    def rpc_reactivateUser(self, token, username):
+        self._user(username)["active"] = True
+        return True
+
+    def rpc_changeUserPassword(self, token, username, password):
+        self._user(username)
+        return True
+
+    def rpc_addUserToGroup(self, token, username, group):
+        self._user(username)
+        if group not in self.groups:
+            raise xmlrpclib.Fault(0, "No group found: %s" % group)
+        self.groups[group].add(username)
+        return True
+
+    def rpc_removeUserFromGroup(self, token, username, group):
+        self._user(username)
+        self.groups.get(group, set()).discard(username)
+        return True
+
+    def rpc_getActiveUsers(self, token, view_all):
+        return sorted(name for name, user in self.users.items() if user["active"])
+
+def Serve(host="127.0.0.1", port=0, **dataset):
+    server = FakeServer((host, port), FakeRequestHandler, logRequests=False,
+                        allow_none=True)
+    url = "http://%s:%d" % server.server_address
+    fake = FakeConfluence(url, **dataset)
+    server.register_instance(fake)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, fake, url
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Confluence XML-RPC server")
+    parser.add_argument("-H", "--host", help="Listen address", default="127.0.0.1")
+    parser.add_argument("-P", "--port", help="Listen port", type=int, default=8090)
+    parser.add_argument("--spaces", help="Number of spaces", type=int, default=2)
+    parser.add_argument("--pages", help="Pages per space", type=int, default=10)
+    parser.add_argument("--users", help="Number of users", type=int, default=10)
+    parser.add_argument("--groups", help="Number of groups", type=int, default=3)
+    parser.add_argument("--page-size", help="Page body size in bytes", type=int, default=2000)
+    parser.add_argument("--latency", help="Per-call latency in seconds", type=float, default=0.0)
+    parser.add_argument("--jitter", help="Per-call latency jitter in seconds", type=float, default=0.0)
+    parser.add_argument("--fail-rate", help="Fraction of calls answered with 503", type=float, default=0.0)
+    parser.add_argument("--idle-timeout", help="Close connections idle for this many seconds (0 keeps them open)",
+                        type=float, default=0.0)
+    args = parser.parse_args()
+    server, fake, url = Serve(args.host, args.port, spaces=args.spaces, pages=args.pages,
+                              users=args.users, groups=args.groups, latency=args.latency,
+                              jitter=args.jitter, page_size=args.page_size,
+                              fail_rate=args.fail_rate, idle_timeout=args.idle_timeout)
+    print("Serving fake Confluence on %s" % url)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright (C) 2013  Remy van Elst
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, sys, time, shutil, threading, subprocess, tempfile, unittest, xmlrpclib
+
+import confluencecli, fakeconfluence
+
+CONFLUENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "confluence.py")
+
+class FakeServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.fake, self.url = fakeconfluence.Serve(spaces=1, pages=3, users=0, groups=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_command(self, *argv, **options):
+        self.fake.counts = {}
+        command = [sys.executable, CONFLUENCE, "-w", self.url, "-u", "test", "-p", "test", "--no-agent"] + list(argv)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=options.get("cwd"))
+        output, errors = process.communicate()
+        self.assertEqual(process.returncode, options.get("status", 0), errors)
+        return output
+
+class RpcCountTest(FakeServerTest):
+
+    def assertCalls(self, calls):
+        expected = dict(("confluence2." + method, count) for method, count in calls.items())
+        expected["confluence2.login"] = 1
+        self.assertEqual(self.fake.counts, expected)
+
+    def content_file(self, content):
+        handle, filename = tempfile.mkstemp(suffix=".html")
+        os.write(handle, content)
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    def test_addpage(self):
+        output = self.run_command("addpage", "-n", "New page", "-s", "SP0", "-f", self.content_file("<p>new</p>"))
+        self.assertEqual(output, "%s/display/SP0/New+page\n" % self.url)
+        self.assertCalls({"storePage": 1, "addLabelByName": 1})
+
+    def test_updatepage(self):
+        self.run_command("updatepage", "-n", "Page 1 of SP0", "-s", "SP0", "-f", self.content_file("<p>changed</p>"))
+        self.assertCalls({"getPage": 1, "storePage": 1, "addLabelByName": 1})
+        self.assertEqual(self.fake._find("SP0", "Page 1 of SP0")["content"], "<p>changed</p>")
+
+    def test_getpagecontent(self):
+        output = self.run_command("getpagecontent", "-n", "Page 1 of SP0", "-s", "SP0")
+        self.assertEqual(output, self.fake._find("SP0", "Page 1 of SP0")["content"] + "\n")
+        self.assertCalls({"getPage": 1})
+
+class IncrementalExportTest(FakeServerTest):
+    def setUp(self):
+        FakeServerTest.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.export()
+
+    def export(self):
+        return self.run_command("getallpages", "--incremental", cwd=self.directory)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".html"))
+
+    def test_unchanged(self):
+        self.assertIn("0 saved, 0 renamed, 3 unchanged, 0 removed, 0 failures", self.export())
+        self.assertEqual(self.fake.counts.get("confluence2.getPage"), 3)
+
+    def test_renamed_page(self):
+        self.fake._find("SP0", "Page 1 of SP0")["title"] = "Renamed"
+        output = self.export()
+        self.assertIn("Renamed page: SP0_Page 1 of SP0.html -> SP0_Renamed.html", output)
+        self.assertIn("0 saved, 1 renamed, 2 unchanged, 0 removed, 0 failures", output)
+        self.assertEqual(self.files(), ["SP0_Page 0 of SP0.html", "SP0_Page 2 of SP0.html", "SP0_Renamed.html"])
+
+    def test_deleted_page(self):
+        del self.fake.pages[self.fake._find("SP0", "Page 2 of SP0")["id"]]
+        output = self.export()
+        self.assertIn("Removed page: SP0_Page 2 of SP0.html", output)
+        self.assertIn("0 saved, 0 renamed, 2 unchanged, 1 removed, 0 failures", output)
+        self.assertEqual(self.files(), ["SP0_Page 0 of SP0.html", "SP0_Page 1 of SP0.html"])
+
+    def test_nothing_seen_keeps_files(self):
+        self.fake.pages.clear()
+        output = self.export()
+        self.assertIn("Not removing deleted pages: no pages were seen", output)
+        self.assertEqual(len(self.files()), 3)
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.fake, self.url = fakeconfluence.Serve(spaces=1, pages=3, users=5, groups=0)
+        self.pool = confluencecli.ConfluenceConnectionPool()
+        self.scheduler = confluencecli.ConfluenceScheduler(backoff=1.0)
+        url = self.url + "/rpc/xmlrpc"
+        transport = confluencecli.ConfluenceTransport(pool=self.pool)
+        self.xml_server = confluencecli.ConfluenceServer(xmlrpclib.Server(url, transport=transport),
+                                                         transport, url, self.scheduler)
+        self.token = self.xml_server.confluence2.login("test", "test")
+
+    def tearDown(self):
+        for connections in self.pool.idle.values():
+            for connection in connections:
+                connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def idle_connections(self):
+        return sum(len(connections) for connections in self.pool.idle.values())
+
+    def pages(self, space_key):
+        space = confluencecli.ConfluenceSpace(self.token, self.xml_server)
+        listed = [confluencecli.ConfluencePageSummary.from_struct(page) for page in space.get_all_pages(space_key)]
+        received = confluencecli.stats.methods.get("confluence2.getPages", {}).get("received", 0)
+        streamed = list(space.iter_pages(space_key))
+        received = confluencecli.stats.methods["confluence2.getPages"]["received"] - received
+        self.assertEqual(streamed, listed)
+        return streamed, received
+
+    def test_iter_pages(self):
+        pages, received = self.pages("SP0")
+        self.assertEqual([page.title for page in pages], ["Page %d of SP0" % n for n in range(3)])
+        self.assertEqual(pages[0]["url"], self.url + "/display/SP0/Page+0+of+SP0")
+
+    def test_iter_pages_gzip(self):
+        self.fake._add_space("BIG", "Big space")
+        for n in range(50):
+            self.fake._store("BIG", u"Gr\xfc\xdfe %d & <more>" % n, "<p>%d</p>" % n)
+        pages, received = self.pages("BIG")
+        self.assertEqual(len(pages), 50)
+        self.assertEqual(pages[7].title, u"Gr\xfc\xdfe 7 & <more>")
+        body = xmlrpclib.dumps(([dict(page._asdict()) for page in pages],), methodresponse=True)
+        self.assertLess(received, len(body) // 2)
+
+    def test_iter_pages_fault(self):
+        space = confluencecli.ConfluenceSpace(self.token, self.xml_server)
+        with self.assertRaises(xmlrpclib.Fault) as listed:
+            space.get_all_pages("NOPE")
+        with self.assertRaises(xmlrpclib.Fault) as streamed:
+            list(space.iter_pages("NOPE"))
+        self.assertEqual(streamed.exception.faultString, listed.exception.faultString)
+        self.assertIn("No space found", streamed.exception.faultString)
+        self.assertEqual(len(self.xml_server.confluence2.getSpaces(self.token)), 1)
+
+    def test_dead_pooled_connections(self):
+        self.fake.idle_timeout = 0.2
+        self.fake.latency = 0.1
+        threads = [threading.Thread(target=self.xml_server.confluence2.getSpaces, args=(self.token,))
+                   for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.idle_connections(), 6)
+        self.fake.latency = 0.0
+        time.sleep(0.5)
+        started = time.time()
+        users = list(confluencecli.ConfluenceUser(self.token, self.xml_server, "").iter_all())
+        self.assertEqual(users, ["user%d" % n for n in range(5)])
+        self.assertEqual(len(self.xml_server.confluence2.getSpaces(self.token)), 1)
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(self.scheduler.limit, 16.0)
+
+if __name__ == '__main__':
+    unittest.main()